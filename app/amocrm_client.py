@@ -1,19 +1,129 @@
-import os
+import asyncio
+import re
+import time
 import httpx
-from typing import Optional, Dict, Any, Union, List
+from typing import Optional, Dict, Any, Union, List, Tuple, Iterator, AsyncIterator
+
+from app import metrics
+from app.rate_limiter import TokenBucket
+from app.amocrm_metadata import AmoCRMMetadata
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Максимальное количество сущностей в одном запросе к API amoCRM v4.
+MAX_BATCH_SIZE = 250
+
+# Лимит amoCRM: не более 7 запросов в секунду на аккаунт.
+DEFAULT_REQUESTS_PER_SECOND = 7
+
+# Повторы при ответах 429/5xx и сетевых ошибках.
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# POST (создание сделок и примечаний) не идемпотентен: после 5xx или обрыва ответа
+# запрос мог быть выполнен, и повтор создал бы до 250 дублей. Такие запросы повторяются
+# только при 429 и ошибках, при которых запрос точно не был отправлен.
+NON_IDEMPOTENT_RETRY_STATUS_CODES = {429}
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# ID в пути заменяются шаблоном, чтобы метки метрик не зависели от конкретных сделок.
+_PATH_ID = re.compile(r"/\d+(?=/|$)")
+
+amocrm_requests = metrics.Counter(
+    "amocrm_requests_total", "Запросы к API amoCRM по эндпоинту и коду ответа.",
+    labelnames=("method", "endpoint", "status")
+)
+amocrm_request_duration = metrics.Histogram(
+    "amocrm_request_duration_seconds", "Длительность запросов к API amoCRM.",
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0), labelnames=("method", "endpoint")
+)
+amocrm_retries = metrics.Counter(
+    "amocrm_retries_total", "Повторы запросов к amoCRM по причине (код ответа или network).",
+    labelnames=("reason",)
+)
+amocrm_rate_limited = metrics.Counter(
+    "amocrm_rate_limited_total", "Ответы 429 (превышен лимит запросов amoCRM)."
+)
+amocrm_rate_limit_wait = metrics.Histogram(
+    "amocrm_rate_limit_wait_seconds", "Ожидание разрешения ограничителя частоты перед запросом.",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+
+def _endpoint_label(endpoint: str) -> str:
+    return _PATH_ID.sub("/{id}", "/" + endpoint.strip("/"))
+
 
 class AmoCRMClient:
-    """Асинхронный клиент для работы с API amoCRM v4."""
+    """
+    Асинхронный клиент для работы с API amoCRM v4.
+    Держит одно долгоживущее HTTP-соединение (пул keep-alive, HTTP/2 при наличии 'h2')
+    и общий ограничитель частоты запросов. Открывается через open() или 'async with'.
+    """
 
-    def __init__(self, subdomain: str, token: str):
+    def __init__(
+        self,
+        subdomain: str,
+        token: str,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        base_url: Optional[str] = None,
+        metadata_ttl_seconds: float = 3600,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
         if not subdomain or not token:
             raise ValueError("Субдомен и токен amoCRM должны быть предоставлены.")
 
-        self.base_url = f"https://{subdomain}.amocrm.ru/api/v4/"
+        self.base_url = base_url or f"https://{subdomain}.amocrm.ru/api/v4/"
         self.headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
         }
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        # Кэш воронок, этапов и кастомных полей (см. AmoCRMMetadata)
+        self.metadata = AmoCRMMetadata(self, ttl_seconds=metadata_ttl_seconds)
+
+    async def open(self):
+        """Создает общий HTTP-клиент с пулом соединений."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(30.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=60),
+                transport=self._transport,
+            )
+
+    async def close(self):
+        """Закрывает HTTP-клиент и все соединения пула."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "AmoCRMClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @staticmethod
+    def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+        """Задержка перед повтором: Retry-After из ответа или экспоненциальная."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return max(float(retry_after), 0.0)
+                except ValueError:
+                    pass
+        return RETRY_BASE_DELAY * (2 ** attempt)
 
     async def _make_request(
         self,
@@ -23,18 +133,54 @@ class AmoCRMClient:
         params: Optional[Dict] = None,
     ) -> Optional[Dict[str, Any]]:
         """Внутренний метод для выполнения запросов к API."""
-        url = f"{self.base_url}{endpoint}"
-        async with httpx.AsyncClient() as client:
+        if self._client is None:
+            await self.open()
+        endpoint_label = _endpoint_label(endpoint)
+        duration = amocrm_request_duration.labels(method=method, endpoint=endpoint_label)
+        idempotent = method.upper() != "POST"
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRY_STATUS_CODES
+
+        for attempt in range(MAX_RETRIES + 1):
+            waited_from = time.perf_counter()
+            await self.rate_limiter.acquire()
+            started = time.perf_counter()
+            amocrm_rate_limit_wait.observe(started - waited_from)
+            response = None
             try:
-                response = await client.request(
-                    method, url, json=data, params=params, headers=self.headers
-                )
+                try:
+                    response = await self._client.request(method, endpoint, json=data, params=params)
+                finally:
+                    duration.observe(time.perf_counter() - started)
+                    status = str(response.status_code) if response is not None else "network_error"
+                    amocrm_requests.labels(method=method, endpoint=endpoint_label, status=status).inc()
+                if response.status_code == 429:
+                    amocrm_rate_limited.inc()
+                if response.status_code in retry_status_codes and attempt < MAX_RETRIES:
+                    amocrm_retries.labels(reason=str(response.status_code)).inc()
+                    delay = self._retry_delay(response, attempt)
+                    print(f"amoCRM ответил {response.status_code}, повтор через {delay:.1f} с...")
+                    # Притормаживаем все запросы клиента, а не только текущий
+                    self.rate_limiter.pause(delay)
+                    continue
                 response.raise_for_status()
+                if response.status_code == 204 or not response.content:
+                    return None
                 return response.json()
             except httpx.HTTPStatusError as e:
                 print(f"Ошибка API amoCRM: {e.response.status_code} - {e.response.text}")
+                return None
+            except httpx.TransportError as e:
+                if attempt < MAX_RETRIES and (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    amocrm_retries.labels(reason="network").inc()
+                    delay = self._retry_delay(None, attempt)
+                    print(f"Сетевая ошибка при запросе к amoCRM: {e}. Повтор через {delay:.1f} с...")
+                    await asyncio.sleep(delay)
+                    continue
+                print(f"Произошла ошибка при запросе к amoCRM: {e}")
+                return None
             except Exception as e:
                 print(f"Произошла ошибка при запросе к amoCRM: {e}")
+                return None
         return None
 
     async def get_lead(self, lead_id: int) -> Optional[Dict[str, Any]]:
@@ -42,6 +188,56 @@ class AmoCRMClient:
         params = {"with": "contacts"}
         return await self._make_request("GET", f"leads/{lead_id}", params=params)
 
+    async def get_leads(self, lead_ids: List[int]) -> List[Dict[str, Any]]:
+        """Получает несколько сделок одним запросом на пачку (GET /leads?filter[id][]=...)."""
+        leads = []
+        for chunk in self._chunks(list(lead_ids)):
+            params = {"filter[id][]": chunk, "limit": len(chunk), "with": "contacts"}
+            response = await self._make_request("GET", "leads", params=params)
+            if response:
+                leads.extend(response.get("_embedded", {}).get("leads", []))
+        return leads
+
+    async def iter_leads_updated_since(self, updated_from: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Выгружает сделки, измененные начиная с updated_from (unix-время), постранично по ключу:
+        следующая страница запрашивается с filter[updated_at][from], равным наибольшему
+        updated_at предыдущей. Сделка, измененная во время выгрузки, уезжает в конец выборки,
+        не сдвигая остальные страницы, поэтому сделки на границах страниц не теряются.
+        Повторно полученные сделки отбрасываются по id. Отдает сделки пачками по странице.
+        """
+        cursor = updated_from
+        page = 1
+        seen = set()  # id сделок с updated_at == cursor, уже отданных
+        while True:
+            response = await self._make_request("GET", "leads", params={
+                "filter[updated_at][from]": cursor,
+                "order[updated_at]": "asc",
+                "limit": MAX_BATCH_SIZE,
+                "page": page,
+            })
+            page_leads = (response or {}).get("_embedded", {}).get("leads", [])
+
+            leads = []
+            for lead in page_leads:
+                if lead.get("id") in seen and int(lead.get("updated_at") or 0) == cursor:
+                    continue
+                leads.append(lead)
+            if leads:
+                yield leads
+
+            if not page_leads or "next" not in (response or {}).get("_links", {}):
+                return
+            last_updated = max(int(lead.get("updated_at") or 0) for lead in page_leads)
+            if last_updated > cursor:
+                cursor = last_updated
+                page = 1
+                seen = {lead.get("id") for lead in page_leads if int(lead.get("updated_at") or 0) == cursor}
+            else:
+                # Целая страница с одним updated_at: ключ не сдвинуть, идем по страницам внутри него
+                page += 1
+                seen.update(lead.get("id") for lead in page_leads)
+
     async def create_lead(self, lead_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Создает одну новую сделку."""
         return await self._make_request("POST", "leads", data=[lead_data])
@@ -61,21 +257,92 @@ class AmoCRMClient:
         return await self._make_request("POST", f"leads/{lead_id}/notes", data=note_data)
 
     @staticmethod
-    def format_custom_fields(fields: Dict[str, Any]) -> list:
+    def _chunks(items: List[Any], size: int = MAX_BATCH_SIZE) -> Iterator[List[Any]]:
+        """Разбивает список на части не больше лимита API."""
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    async def create_leads(self, leads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Создает сделки пачками (POST /leads).
+        Возвращает список созданных сделок. У каждой сохраняется 'request_id'
+        из запроса, чтобы сопоставить ID сделки с исходной строкой.
+        """
+        created = []
+        for chunk in self._chunks(leads):
+            response = await self._make_request("POST", "leads", data=chunk)
+            if not response:
+                continue
+            result = response.get("_embedded", {}).get("leads", [])
+            # API возвращает сделки в порядке запроса; если request_id не вернулся,
+            # восстанавливаем его по позиции.
+            for sent, lead in zip(chunk, result):
+                if "request_id" in sent and not lead.get("request_id"):
+                    lead["request_id"] = sent["request_id"]
+            created.extend(result)
+        return created
+
+    async def update_leads(self, leads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Обновляет сделки пачками (PATCH /leads). Каждая сделка должна содержать 'id'."""
+        updated = []
+        for chunk in self._chunks(leads):
+            response = await self._make_request("PATCH", "leads", data=chunk)
+            if response:
+                updated.extend(response.get("_embedded", {}).get("leads", []))
+        return updated
+
+    async def create_notes(self, notes: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+        """Создает текстовые примечания к сделкам пачками (POST /leads/notes)."""
+        note_data = [
+            {
+                "entity_id": lead_id,
+                "note_type": "common",
+                "params": {"text": note_text},
+            }
+            for lead_id, note_text in notes
+        ]
+        created = []
+        for chunk in self._chunks(note_data):
+            response = await self._make_request("POST", "leads/notes", data=chunk)
+            if response:
+                created.extend(response.get("_embedded", {}).get("notes", []))
+        return created
+
+    async def _get_all_pages(self, endpoint: str, entity: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Выгружает все страницы списка сущностей (по ссылке _links.next)."""
+        items = []
+        page = 1
+        while True:
+            response = await self._make_request("GET", endpoint, params={"limit": limit, "page": page})
+            if not response:
+                break
+            items.extend(response.get("_embedded", {}).get(entity, []))
+            if "next" not in response.get("_links", {}):
+                break
+            page += 1
+        return items
+
+    async def get_pipelines(self) -> List[Dict[str, Any]]:
+        """Возвращает воронки сделок вместе с их этапами (GET /leads/pipelines)."""
+        response = await self._make_request("GET", "leads/pipelines")
+        return (response or {}).get("_embedded", {}).get("pipelines", [])
+
+    async def get_custom_fields(self) -> List[Dict[str, Any]]:
+        """Возвращает описания всех кастомных полей сделок (GET /leads/custom_fields)."""
+        return await self._get_all_pages("leads/custom_fields", "custom_fields")
+
+    def format_custom_fields(self, fields: Dict[str, Any]) -> list:
         """
         Форматирует кастомные поля в формат, понятный API amoCRM.
         Пример: {"Телефон": "12345", "Email": "test@test.com"}
+        ID полей берутся по названию из кэша справочников (self.metadata).
         """
         custom_fields = []
-        # ID полей нужно будет получить из вашего аккаунта amoCRM
-        field_id_map = {
-            "Телефон": 225341,  # Замените на реальные ID
-            "Email": 225343,    # Замените на реальные ID
-        }
         for name, value in fields.items():
-            if name in field_id_map:
+            field_id = self.metadata.field_id(name)
+            if field_id:
                 custom_fields.append({
-                    "field_id": field_id_map[name],
+                    "field_id": field_id,
                     "values": [{"value": value}]
                 })
         return custom_fields
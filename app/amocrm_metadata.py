@@ -0,0 +1,125 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Тип статуса "Неразобранное" в amoCRM: новые сделки туда не создаются.
+UNSORTED_STATUS_TYPE = 1
+# Через сколько секунд повторять загрузку справочников после неудачи.
+RETRY_SECONDS = 60
+
+
+class AmoCRMMetadata:
+    """
+    Кэш справочников amoCRM: воронки, этапы и кастомные поля сделок.
+    Загружается один раз и обновляется по истечении TTL, поэтому поиск
+    названия этапа или ID поля — это обращение к словарю, без запросов к API.
+    """
+
+    def __init__(self, amo_client, ttl_seconds: float = 3600):
+        self.amo_client = amo_client
+        self.ttl_seconds = ttl_seconds
+        self.loaded_at: Optional[float] = None
+        # После неудачной загрузки или досрочного обновления (refresh_on_miss) следующая
+        # загрузка не раньше этого момента, иначе запрос на каждый вызов
+        self.retry_at: Optional[float] = None
+
+        self._pipelines: Dict[int, Dict[str, Any]] = {}
+        self._pipelines_by_name: Dict[str, int] = {}
+        self._statuses: Dict[Tuple[int, int], str] = {}
+        self._fields_by_name: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        """Загружает воронки, этапы и кастомные поля из amoCRM."""
+        pipelines = await self.amo_client.get_pipelines()
+        fields = await self.amo_client.get_custom_fields()
+        if not pipelines:
+            print(
+                f"Не удалось загрузить воронки amoCRM, используется прежний кэш. "
+                f"Повтор через {RETRY_SECONDS} с."
+            )
+            self.retry_at = time.monotonic() + RETRY_SECONDS
+            return
+
+        self._pipelines = {}
+        self._pipelines_by_name = {}
+        self._statuses = {}
+        for pipeline in pipelines:
+            statuses = sorted(
+                pipeline.get("_embedded", {}).get("statuses", []),
+                key=lambda status: status.get("sort", 0),
+            )
+            self._pipelines[pipeline["id"]] = {
+                "name": pipeline.get("name"),
+                "is_main": pipeline.get("is_main", False),
+                "statuses": statuses,
+            }
+            self._pipelines_by_name[pipeline.get("name")] = pipeline["id"]
+            for status in statuses:
+                self._statuses[(pipeline["id"], status["id"])] = status.get("name")
+
+        if fields:
+            self._fields_by_name = {field.get("name"): field["id"] for field in fields}
+
+        self.loaded_at = time.monotonic()
+        self.retry_at = None
+        print(
+            f"Справочники amoCRM загружены: воронок {len(self._pipelines)}, "
+            f"этапов {len(self._statuses)}, полей {len(self._fields_by_name)}."
+        )
+
+    def _is_fresh(self) -> bool:
+        """Кэш актуален, либо после неудачной загрузки еще не пора повторять."""
+        now = time.monotonic()
+        if self.retry_at is not None and now < self.retry_at:
+            return True
+        return self.loaded_at is not None and now - self.loaded_at < self.ttl_seconds
+
+    async def ensure_fresh(self):
+        """Обновляет кэш, если он еще не загружен или устарел."""
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if not self._is_fresh():
+                await self.refresh()
+
+    async def refresh_on_miss(self):
+        """
+        Досрочно обновляет кэш, когда в нем не нашлось нужного значения
+        (например, этап добавили после загрузки). Не чаще раза в RETRY_SECONDS.
+        """
+        async with self._lock:
+            if self.retry_at is not None and time.monotonic() < self.retry_at:
+                return
+            await self.refresh()
+            self.retry_at = time.monotonic() + RETRY_SECONDS
+
+    def status_name(self, pipeline_id: Optional[int], status_id: Optional[int]) -> Optional[str]:
+        """Название этапа по ID воронки и этапа."""
+        return self._statuses.get((pipeline_id, status_id))
+
+    def field_id(self, field_name: str) -> Optional[int]:
+        """ID кастомного поля сделки по его названию."""
+        return self._fields_by_name.get(field_name)
+
+    def pipeline_id(self, pipeline_name: Optional[str] = None) -> Optional[int]:
+        """ID воронки по названию; без названия — ID главной воронки."""
+        if pipeline_name:
+            return self._pipelines_by_name.get(pipeline_name)
+        for pipeline_id, pipeline in self._pipelines.items():
+            if pipeline["is_main"]:
+                return pipeline_id
+        return None
+
+    def status_id(self, pipeline_id: Optional[int], status_name: Optional[str] = None) -> Optional[int]:
+        """ID этапа воронки по названию; без названия — первый этап после "Неразобранного"."""
+        pipeline = self._pipelines.get(pipeline_id)
+        if not pipeline:
+            return None
+        for status in pipeline["statuses"]:
+            if status_name:
+                if status.get("name") == status_name:
+                    return status["id"]
+            elif status.get("type") != UNSORTED_STATUS_TYPE:
+                return status["id"]
+        return None
@@ -7,15 +7,70 @@ load_dotenv()
 # --- Настройки amoCRM ---
 AMOCRM_SUBDOMAIN = os.getenv("AMOCRM_SUBDOMAIN")
 AMOCRM_INTEGRATION_TOKEN = os.getenv("AMOCRM_INTEGRATION_TOKEN")
+# Лимит запросов к API amoCRM в секунду (по умолчанию 7 — квота amoCRM на аккаунт).
+AMOCRM_REQUESTS_PER_SECOND = float(os.getenv("AMOCRM_REQUESTS_PER_SECOND", "7"))
+# Воронка и этап для новых сделок (по названию). Если не заданы — главная воронка и ее первый этап.
+AMOCRM_PIPELINE_NAME = os.getenv("AMOCRM_PIPELINE_NAME")
+AMOCRM_STATUS_NAME = os.getenv("AMOCRM_STATUS_NAME")
+# Как часто (в минутах) обновлять кэш воронок, этапов и кастомных полей.
+AMOCRM_METADATA_TTL_MINUTES = float(os.getenv("AMOCRM_METADATA_TTL_MINUTES", "60"))
 
 # --- Настройки Google ---
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Размер пула потоков для запросов к Google Sheets (gspread синхронный).
+GOOGLE_SHEETS_MAX_WORKERS = int(os.getenv("GOOGLE_SHEETS_MAX_WORKERS", "4"))
+
+# --- Локальное состояние ---
+# Файл SQLite с состоянием синхронизации (отпечатки строк и т.п.).
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/sync_state.db")
+
+# --- Outbox (надежная очередь событий и записей) ---
+# Файл SQLite, в котором события вебхуков и записи в таблицу хранятся до успешной обработки.
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "data/outbox.db")
+# Сколько записей outbox брать в работу за раз.
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+# После скольких неудачных попыток запись откладывается как необработанная (dead).
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# --- Координация воркеров ---
+# Хранилище аренд для выбора лидера (планировщик) и деления вебхуков между воркерами:
+# "sqlite" — файл БД (COORDINATION_PATH), "file" — каталог с файловыми блокировками.
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "sqlite")
+COORDINATION_PATH = os.getenv(
+    "COORDINATION_PATH", "data/locks" if COORDINATION_BACKEND == "file" else "data/coordination.db"
+)
+# Срок аренды (в секундах): за это время задачи упавшего лидера перейдут другому воркеру.
+COORDINATION_LEASE_SECONDS = float(os.getenv("COORDINATION_LEASE_SECONDS", "30"))
+
+# --- Синхронизация Sheets -> amoCRM ---
+# Сколько пачек сделок отправлять в amoCRM параллельно (под общим лимитом запросов).
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
+
+# --- Сверка amoCRM -> Sheets ---
+# Интервал (в минутах) инкрементальной сверки по updated_at.
+RECONCILE_INTERVAL_MINUTES = int(os.getenv("RECONCILE_INTERVAL_MINUTES", "10"))
+
+# --- Очередь вебхуков ---
+# Окно (в секундах), в течение которого события по одной сделке объединяются.
+WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv("WEBHOOK_DEBOUNCE_SECONDS", "2"))
+# Количество параллельных воркеров, обрабатывающих пачки сделок.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# Максимальное количество сделок в одной пачке.
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+
+# --- Наблюдаемость ---
+# Писать ли в лог JSON-строки с длительностью участков синхронизации (spans).
+# Гистограммы длительности доступны на /metrics в любом случае.
+TRACE_SPANS = os.getenv("TRACE_SPANS", "true").lower() not in ("0", "false", "no")
 
 # Проверка, что все необходимые переменные были загружены
-if not all([AMOCRM_SUBDOMAIN, AMOCRM_INTEGRATION_TOKEN, GOOGLE_SHEET_ID, GOOGLE_APPLICATION_CREDENTIALS]):
-    missing = [
-        var for var, val in locals().items() 
-        if var.isupper() and not val
-    ]
+_REQUIRED = {
+    "AMOCRM_SUBDOMAIN": AMOCRM_SUBDOMAIN,
+    "AMOCRM_INTEGRATION_TOKEN": AMOCRM_INTEGRATION_TOKEN,
+    "GOOGLE_SHEET_ID": GOOGLE_SHEET_ID,
+    "GOOGLE_APPLICATION_CREDENTIALS": GOOGLE_APPLICATION_CREDENTIALS,
+}
+if not all(_REQUIRED.values()):
+    missing = [var for var, val in _REQUIRED.items() if not val]
     raise ImportError(f"КРИТИЧЕСКАЯ ОШИБКА: Не найдены переменные окружения: {', '.join(missing)}. Проверьте ваш .env файл.")
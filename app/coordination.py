@@ -0,0 +1,289 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable
+
+from app import metrics
+
+# Аренда, владелец которой выполняет задачи планировщика.
+LEADER_LEASE = "scheduler-leader"
+# Префикс аренд участников: по живым участникам сделки делятся между воркерами.
+MEMBER_LEASE_PREFIX = "member:"
+DEFAULT_LEASE_SECONDS = 30
+
+coordination_is_leader = metrics.Gauge(
+    "coordination_is_leader", "1, если этот процесс выполняет задачи планировщика."
+)
+coordination_members = metrics.Gauge(
+    "coordination_members", "Живые воркеры, между которыми делятся события по сделкам."
+)
+coordination_errors = metrics.Counter(
+    "coordination_errors_total", "Ошибки обращения к хранилищу аренд."
+)
+
+
+def default_owner() -> str:
+    """
+    Идентификатор процесса: хост, PID и случайный суффикс — после перезапуска
+    контейнера PID может совпасть, а аренды прежнего процесса не должны считаться своими.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseBackend:
+    """
+    Хранилище аренд (lease). Реализации взаимозаменяемы: для одного хоста подходят
+    SQLite и файловые блокировки, для нескольких узлов — общее хранилище
+    (Redis, PostgreSQL) с теми же тремя методами.
+    """
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Берет аренду или продлевает свою. False — аренда у другого владельца."""
+        raise NotImplementedError
+
+    def release(self, name: str, owner: str):
+        """Освобождает аренду, если она принадлежит owner."""
+        raise NotImplementedError
+
+    def holders(self, prefix: str) -> dict[str, str]:
+        """Действующие аренды с именем, начинающимся с prefix: имя -> владелец."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Аренды с TTL в файле SQLite. Подходит для нескольких процессов на одном хосте:
+    аренда упавшего процесса освобождается по истечении TTL.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            # Чужая действующая аренда не перезаписывается: условие WHERE в upsert
+            self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl, now),
+            )
+            row = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+            self._conn.commit()
+        return row is not None and row[0] == owner
+
+    def release(self, name: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+            self._conn.commit()
+
+    def holders(self, prefix: str) -> dict[str, str]:
+        with self._lock:
+            # Истекшая аренда равносильна отсутствующей, поэтому ее можно удалить
+            self._conn.execute("DELETE FROM leases WHERE expires_at < ?", (time.time(),))
+            rows = self._conn.execute(
+                "SELECT name, owner FROM leases WHERE substr(name, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+            self._conn.commit()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FileLockBackend(LeaseBackend):
+    """
+    Аренды как блокировки fcntl.flock на файлах в каталоге. Блокировку снимает ОС
+    при завершении процесса, поэтому TTL не нужен. Только для одного хоста (не для NFS).
+    """
+
+    def __init__(self, directory: str):
+        import fcntl  # нет в Windows; нужен только этому хранилищу
+
+        self._fcntl = fcntl
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._held: dict[str, int] = {}  # имя -> дескриптор файла с блокировкой
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name.replace(":", "_").replace("/", "_") + ".lock")
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        if name in self._held:
+            return True
+        fd = os.open(self._path(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, owner.encode())
+        self._held[name] = fd
+        return True
+
+    def release(self, name: str, owner: str):
+        fd = self._held.pop(name, None)
+        if fd is not None:
+            self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+            os.close(fd)
+
+    def holders(self, prefix: str) -> dict[str, str]:
+        result = {}
+        file_prefix = os.path.basename(self._path(prefix))[:-len(".lock")]
+        for filename in os.listdir(self.directory):
+            if not filename.startswith(file_prefix) or not filename.endswith(".lock"):
+                continue
+            fd = os.open(os.path.join(self.directory, filename), os.O_RDONLY)
+            try:
+                # Если блокировку удалось взять, файл остался от завершенного процесса
+                self._fcntl.flock(fd, self._fcntl.LOCK_SH | self._fcntl.LOCK_NB)
+                self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+            except BlockingIOError:
+                result[filename[:-len(".lock")]] = os.read(fd, 1024).decode()
+            finally:
+                os.close(fd)
+        return result
+
+    def close(self):
+        for name in list(self._held):
+            self.release(name, "")
+
+
+def create_lease_backend(kind: str, path: str) -> LeaseBackend:
+    """Создает хранилище аренд по названию: 'sqlite' (файл БД) или 'file' (каталог блокировок)."""
+    if kind == "sqlite":
+        return SQLiteLeaseBackend(path)
+    if kind == "file":
+        return FileLockBackend(path)
+    raise ValueError(f"Неизвестное хранилище аренд: '{kind}'. Допустимые значения: sqlite, file.")
+
+
+class Coordinator:
+    """
+    Координация воркеров одного сервиса (uvicorn --workers N или несколько узлов
+    с общим хранилищем аренд).
+
+    Лидер — владелец аренды LEADER_LEASE — выполняет задачи планировщика, чтобы
+    синхронизация не запускалась одновременно в каждом воркере. Каждый воркер держит
+    аренду участника; события по сделкам делятся между живыми участниками по lead_id
+    (см. shard()), поэтому одну сделку обрабатывает один воркер.
+    При смене состава вызывается on_members_changed — например, чтобы поделить
+    общий лимит запросов к API между воркерами.
+    """
+
+    def __init__(
+        self,
+        backend: LeaseBackend,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        owner: str | None = None,
+        on_elected: Callable[[], None] | None = None,
+        on_revoked: Callable[[], None] | None = None,
+        on_members_changed: Callable[[list[str]], None] | None = None,
+    ):
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.owner = owner or default_owner()
+        self.on_elected = on_elected
+        self.on_revoked = on_revoked
+        self.on_members_changed = on_members_changed
+
+        self.is_leader = False
+        self._members: list[str] = [self.owner]
+        self._task: asyncio.Task | None = None
+
+        coordination_is_leader.set_function(lambda: int(self.is_leader))
+        coordination_members.set_function(lambda: len(self._members))
+
+    def members(self) -> list[str]:
+        """Живые участники (по данным последнего продления аренд)."""
+        return list(self._members)
+
+    def shard(self) -> tuple[int, int]:
+        """
+        Доля событий этого воркера: (номер, количество участников).
+        Воркеру достаются сделки с lead_id % количество == номер.
+        """
+        return self._members.index(self.owner), len(self._members)
+
+    async def start(self):
+        """Выполняет первое продление аренд (до приема событий) и запускает фоновое продление."""
+        await self._renew()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает продление и освобождает аренды, чтобы их сразу подхватили другие воркеры."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._set_leader(False)
+        await asyncio.to_thread(self._release_all)
+        self.backend.close()
+
+    def _release_all(self):
+        self.backend.release(LEADER_LEASE, self.owner)
+        self.backend.release(MEMBER_LEASE_PREFIX + self.owner, self.owner)
+
+    async def _run(self):
+        while True:
+            # Продлеваем с запасом: аренда не должна истечь между двумя продлениями
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._renew()
+
+    async def _renew(self):
+        try:
+            members, is_leader = await asyncio.to_thread(self._renew_leases)
+        except Exception as e:
+            coordination_errors.inc()
+            print(f"Координация: не удалось продлить аренды: {e}")
+            # Без подтвержденной аренды задачи планировщика не выполняем,
+            # иначе они могут запуститься в двух воркерах
+            self._set_leader(False)
+            return
+        if members != self._members:
+            print(f"Координация: воркеров {len(members)}, доля этого воркера {members.index(self.owner) + 1}/{len(members)}.")
+            self._members = members
+            if self.on_members_changed:
+                self.on_members_changed(list(members))
+        self._set_leader(is_leader)
+
+    def _renew_leases(self) -> tuple[list[str], bool]:
+        self.backend.acquire(MEMBER_LEASE_PREFIX + self.owner, self.owner, self.lease_seconds)
+        members = sorted(set(self.backend.holders(MEMBER_LEASE_PREFIX).values()) | {self.owner})
+        is_leader = self.backend.acquire(LEADER_LEASE, self.owner, self.lease_seconds)
+        return members, is_leader
+
+    def _set_leader(self, is_leader: bool):
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        if is_leader:
+            print("Координация: этот воркер стал лидером и выполняет задачи планировщика.")
+            if self.on_elected:
+                self.on_elected()
+        else:
+            print("Координация: этот воркер больше не лидер.")
+            if self.on_revoked:
+                self.on_revoked()
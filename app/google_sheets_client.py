@@ -1,12 +1,66 @@
 import os
+import re
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import gspread
+from google.auth.transport.requests import Request as AuthRequest
+
+from app import metrics
 
 # Этот метод аутентификации, как в вашем примере с Битрикс,
 # должен быть более устойчивым в окружении WSL.
 # Он использует устаревшую, но надежную библиотеку oauth2client.
 
+# Как часто (в секундах) сверять версию таблицы с кэшем индекса строк.
+INDEX_CHECK_INTERVAL = 30
+# Максимальный возраст индекса, после которого он перестраивается в любом случае.
+INDEX_MAX_AGE = 600
+# Сколько строк читать одним запросом при потоковом чтении листа (iter_rows).
+READ_CHUNK_SIZE = 1000
+# Сколько ячеек отправлять одним запросом values.batchUpdate (у Sheets API есть предел размера запроса).
+WRITE_CHUNK_SIZE = 5000
+# Сколько раз ячейка с ошибкой записи возвращается в буфер, прежде чем ее отбросить:
+# иначе одна неотправляемая запись роняла бы каждый следующий flush() всех вызывающих.
+WRITE_MAX_ATTEMPTS = 3
+# Размер пула потоков для вызовов gspread из асинхронного кода.
+DEFAULT_MAX_WORKERS = 4
+# За сколько секунд до истечения OAuth-токена обновлять его в фоне.
+TOKEN_REFRESH_MARGIN = 300
+# Пауза перед повторной попыткой, если обновить токен не удалось.
+TOKEN_REFRESH_RETRY_DELAY = 30
+
+sheets_requests = metrics.Counter(
+    "sheets_requests_total", "Вызовы Google Sheets API по операции и результату.",
+    labelnames=("operation", "status")
+)
+sheets_request_duration = metrics.Histogram(
+    "sheets_request_duration_seconds", "Длительность вызовов Google Sheets API.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0), labelnames=("operation",)
+)
+
+
+def _api_call(operation: str, func, *args, **kwargs):
+    """Выполняет вызов gspread, замеряя длительность и результат."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        result = func(*args, **kwargs)
+        status = "ok"
+        return result
+    finally:
+        sheets_request_duration.labels(operation=operation).observe(time.perf_counter() - started)
+        sheets_requests.labels(operation=operation, status=status).inc()
+
+
 class GoogleSheetsClient:
-    """Класс для взаимодействия с Google Sheets API."""
+    """
+    Класс для взаимодействия с Google Sheets API.
+    Методы синхронные (gspread); из асинхронного кода используйте AsyncGoogleSheetsClient.
+    """
 
     def __init__(self, sheet_id: str, creds_path: str):
         self.sheet_id = sheet_id
@@ -19,12 +73,48 @@ class GoogleSheetsClient:
             raise FileNotFoundError(f"Файл ключа '{self.creds_path}' не найден.")
 
         self.client = self._connect()
-        if self.client:
-            self.spreadsheet = self.client.open_by_key(self.sheet_id)
-            self.worksheet = self.get_worksheet()  # <- Инициализируем рабочий лист здесь
-        else:
-            self.spreadsheet = None
-            self.worksheet = None  # <- И здесь тоже
+        spreadsheet = _api_call("open", self.client.open_by_key, self.sheet_id) if self.client else None
+        self._attach(spreadsheet)
+
+    @classmethod
+    def from_spreadsheet(cls, spreadsheet, sheet_id: str | None = None) -> "GoogleSheetsClient":
+        """Создает клиент поверх уже открытой таблицы (например, локальной заглушки в бенчмарках)."""
+        client = cls.__new__(cls)
+        client.sheet_id = sheet_id
+        client.creds_path = None
+        client.client = None
+        client._attach(spreadsheet)
+        return client
+
+    def _attach(self, spreadsheet):
+        """Запоминает таблицу и рабочий лист, инициализирует кэши."""
+        self.spreadsheet = spreadsheet
+        # Объекты листов: получение листа по имени — отдельный запрос метаданных таблицы
+        self._worksheets: dict[str, gspread.Worksheet] = {}
+        self.worksheet = self.get_worksheet() if spreadsheet else None
+
+        # Кэш листа: lead_id -> номер строки и значения строк (см. build_index)
+        self._index: dict[str, int] | None = None
+        self._rows: list[list[str]] = []
+        self._header: list[str] = []
+        self._index_version: str | None = None
+        self._index_built_at = 0.0
+        self._index_checked_at = 0.0
+        # Индекс и буфер записи используются из пула потоков AsyncGoogleSheetsClient.
+        # Под _lock и _buffer_lock нет обращений к API: буфер пополняется прямо из цикла
+        # событий и не должен ждать выгрузку листа. Перестроения индекса (с запросами к API)
+        # выполняются по одному под _index_lock.
+        self._lock = threading.RLock()
+        self._buffer_lock = threading.Lock()
+        self._index_lock = threading.RLock()
+        # Записи идут по одной: версия таблицы до и после записи сверяется в flush()
+        self._flush_lock = threading.Lock()
+
+        # Буфер записи: (строка, колонка) -> значение; отправляется пачками batchUpdate в flush()
+        self._write_buffer: dict[tuple[int, int], str] = {}
+        # Неудачные попытки записи ячеек, возвращенных в буфер
+        self._write_failures: dict[tuple[int, int], int] = {}
+        self._column_map: dict[str, int] = {}
 
     def _connect(self):
         """Инициализирует подключение к Google Sheets."""
@@ -36,52 +126,457 @@ class GoogleSheetsClient:
             print(f"Не удалось подключиться к Google Sheets: {e}")
             return None
 
+    def refresh_credentials(self, margin: float = TOKEN_REFRESH_MARGIN) -> float | None:
+        """
+        Обновляет OAuth-токен, если он истекает в ближайшие margin секунд,
+        чтобы обмен токена не попадал в обработку вебхука.
+        Возвращает, через сколько секунд проверить снова (None — обновлять нечего).
+        """
+        credentials = getattr(getattr(self.client, "http_client", None), "auth", None)
+        if credentials is None or not hasattr(credentials, "refresh"):
+            return None
+
+        # expiry в google-auth — наивное время в UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if credentials.expiry is None or credentials.expiry - now <= timedelta(seconds=margin):
+            _api_call("token_refresh", credentials.refresh, AuthRequest())
+            print("Токен Google обновлен.")
+        if credentials.expiry is None:
+            return None
+        delay = (credentials.expiry - now - timedelta(seconds=margin)).total_seconds()
+        return max(delay, TOKEN_REFRESH_RETRY_DELAY)
+
     def get_worksheet(self, sheet_name: str = "Лист1"):
-        """Получает объект рабочего листа по его имени."""
+        """Получает объект рабочего листа по его имени. Лист запрашивается один раз и кэшируется."""
         if not self.spreadsheet:
             return None
-        try:
-            return self.spreadsheet.worksheet(sheet_name)
-        except gspread.WorksheetNotFound:
-            print(f"Лист с именем '{sheet_name}' не найден.")
-            return None
+        worksheet = self._worksheets.get(sheet_name)
+        if worksheet is None:
+            try:
+                worksheet = _api_call("worksheet", self.spreadsheet.worksheet, sheet_name)
+            except gspread.WorksheetNotFound:
+                print(f"Лист с именем '{sheet_name}' не найден.")
+                return None
+            self._worksheets[sheet_name] = worksheet
+        return worksheet
 
     def get_all_records(self, sheet_name: str = "Лист1"):
         """Возвращает все строки из листа в виде словаря."""
         worksheet = self.get_worksheet(sheet_name)
         if worksheet:
-            return worksheet.get_all_records()
+            return _api_call("get_all_records", worksheet.get_all_records)
         return []
 
+    def _set_header(self, header: list[str]):
+        self._header = header
+        self._column_map = {name: i + 1 for i, name in enumerate(header) if name}
+
     def get_worksheet_header(self) -> list[str]:
-        """Возвращает заголовки (первую строку) листа."""
+        """Возвращает заголовки (первую строку) листа. Читаются один раз и кэшируются."""
+        if not self._header:
+            try:
+                self._set_header(_api_call("row_values", self.worksheet.row_values, 1))
+            except Exception:
+                return []
+        return self._header
+
+    def read_header(self) -> list[str]:
+        """
+        Перечитывает заголовки листа (один запрос row_values). Если колонки
+        переставили или добавили, индекс строк сбрасывается вместе с кэшем.
+        """
+        if not self.worksheet:
+            return []
+        header = _api_call("row_values", self.worksheet.row_values, 1)
+        with self._lock:
+            if header != self._header:
+                if self._header:
+                    print("Заголовки таблицы изменились, индекс будет перестроен.")
+                self._set_header(header)
+                self.invalidate_index()
+        return header
+
+    def _lead_id_position(self) -> int:
+        """Позиция колонки lead_id (с 0); без заголовка — первая колонка."""
+        return self._column_map.get("lead_id", 1) - 1
+
+    def column_index(self, column_name: str) -> int | None:
+        """Возвращает номер колонки (с 1) по ее заголовку, без обращения к API."""
+        self.get_worksheet_header()
+        return self._column_map.get(column_name)
+
+    def header_index(self) -> dict[str, int]:
+        """Позиции колонок (с 0) по заголовкам — для доступа к значениям в кортежах строк."""
+        return {name: i for i, name in enumerate(self.get_worksheet_header()) if name}
+
+    def _read_rows(self, start: int, end: int, width: int) -> list[list[str]]:
+        """Читает строки start..end (включительно) одним запросом batch_get."""
+        last_column = re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, width))
+        result = _api_call("batch_get", self.worksheet.batch_get, [f"A{start}:{last_column}{end}"])
+        return list(result[0]) if result else []
+
+    def _get_sheet_version(self) -> str | None:
+        """Возвращает время последнего изменения таблицы (из Drive API)."""
         try:
-            return self.worksheet.row_values(1)
+            return _api_call("last_update_time", self.spreadsheet.get_lastUpdateTime)
         except Exception:
-            return []
+            return None
+
+    def build_index(self):
+        """
+        Строит индекс lead_id -> номер строки по одной выгрузке всего листа.
+        Значения строк сохраняются, чтобы поиск не обращался к API.
+        """
+        if not self.worksheet:
+            return
+        with self._index_lock:
+            # Версия читается до выгрузки: запись, прошедшая во время выгрузки,
+            # сменит версию, и индекс перестроится при следующей проверке
+            version = self._get_sheet_version()
+            values = _api_call("get_all_values", self.worksheet.get_all_values)
+            rows = values[1:]
+            header = values[0] if values else []
+            position = header.index("lead_id") if "lead_id" in header else 0
+            index = {}
+            for row_num, row in enumerate(rows, start=2):
+                if len(row) > position and str(row[position]).strip():
+                    index[str(row[position]).strip()] = row_num
+
+            with self._lock:
+                self._set_header(header)
+                self._rows = rows
+                self._index = index
+                now = time.monotonic()
+                self._index_version = version
+                self._index_built_at = now
+                self._index_checked_at = now
+        print(f"Индекс таблицы построен: {len(index)} строк с lead_id.")
+
+    def invalidate_index(self):
+        """Сбрасывает индекс; он будет перестроен при следующем поиске."""
+        self._index = None
+
+    def _ensure_index(self):
+        """Перестраивает индекс, если он устарел или таблицу изменили извне."""
+        with self._index_lock:
+            self._ensure_index_locked()
+
+    def _ensure_index_locked(self):
+        now = time.monotonic()
+        if self._index is None or now - self._index_built_at > INDEX_MAX_AGE:
+            self.build_index()
+            return
+        if now - self._index_checked_at < INDEX_CHECK_INTERVAL:
+            return
+
+        self._index_checked_at = now
+        version = self._get_sheet_version()
+        if version == self._index_version:
+            return
+        # Версия после собственных записей запоминается в flush(), поэтому любое
+        # расхождение — изменение извне (сортировка, вставка строк, запись другого процесса)
+        print("Таблица изменена извне, индекс будет перестроен.")
+        self.build_index()
+
+    def _apply_to_index(self, row: int, col: int, value: str):
+        """Отражает собственную запись в ячейку в кэше индекса."""
+        with self._lock:
+            self._apply_to_index_locked(row, col, value)
+
+    def _apply_to_index_locked(self, row: int, col: int, value: str):
+        if self._index is None:
+            return
+        position = row - 2
+        if position < 0 or position >= len(self._rows):
+            # Строка за пределами кэша (добавлена после построения индекса)
+            self.invalidate_index()
+            return
+        cached_row = self._rows[position]
+        if len(cached_row) < col:
+            cached_row.extend([""] * (col - len(cached_row)))
+        if col - 1 == self._lead_id_position():
+            old_id = str(cached_row[col - 1]).strip()
+            if old_id and self._index.get(old_id) == row:
+                del self._index[old_id]
+            if str(value).strip():
+                self._index[str(value).strip()] = row
+        cached_row[col - 1] = value
 
     def find_row_by_id(self, lead_id: int) -> tuple[int | None, dict | None]:
-        """Находит номер строки и ее данные по значению в колонке 'lead_id'."""
+        """Находит номер строки и ее данные по значению в колонке 'lead_id' (через индекс)."""
         if not self.worksheet:
             return None, None
         try:
-            cell = self.worksheet.find(str(lead_id), in_column=1)
-            if not cell:
-                return None, None
-            
-            # -2 потому что get_all_records() это список (0-индекс), а header не считается
-            row_data = self.worksheet.get_all_records()[cell.row - 2]
-            return cell.row, row_data
-        except gspread.CellNotFound:  # <- Исправлено имя ошибки
-            print(f"  -> Не найдена строка с lead_id {lead_id}")
-            return None, None
+            self._ensure_index()
+            with self._lock:
+                row_num = self._index.get(str(lead_id)) if self._index is not None else None
+                if not row_num:
+                    return None, None
+
+                row = self._rows[row_num - 2]
+                row_data = {
+                    name: row[i] if i < len(row) else ""
+                    for i, name in enumerate(self._header)
+                }
+            return row_num, row_data
         except Exception as e:
             print(f"  -> Ошибка при поиске строки с lead_id {lead_id}: {e}")
             return None, None
 
-    def update_cell(self, row: int, col: int, value: str, sheet_name: str = "Лист1"):
-        """Обновляет значение в конкретной ячейке."""
-        worksheet = self.get_worksheet(sheet_name)
-        if worksheet:
-            worksheet.update_cell(row, col, value)
-            print(f"Ячейка ({row}, {col}) обновлена значением '{value}'.")
+    def find_rows_by_ids(self, lead_ids: list[int]) -> dict[int, tuple[int, dict]]:
+        """Находит строки сразу для нескольких сделок: lead_id -> (номер строки, данные)."""
+        found = {}
+        for lead_id in lead_ids:
+            row_num, row_data = self.find_row_by_id(lead_id)
+            if row_num:
+                found[lead_id] = (row_num, row_data)
+        return found
+
+    def queue_cell(self, row: int, col: int, value: str):
+        """Добавляет запись ячейки в буфер. Значение уйдет в таблицу при flush()."""
+        with self._buffer_lock:
+            self._write_buffer[(row, col)] = value
+
+    def queue_row_update(self, row: int, values: dict[str, str]):
+        """Добавляет в буфер значения строки по именам колонок. Неизвестные колонки пропускаются."""
+        for column_name, value in values.items():
+            col = self.column_index(column_name)
+            if col:
+                self.queue_cell(row, col, value)
+
+    def flush(self) -> int:
+        """
+        Отправляет накопленные записи запросами values.batchUpdate по WRITE_CHUNK_SIZE ячеек.
+        Пачка с ошибкой не мешает отправке остальных; ее ячейки возвращаются в буфер
+        (не более WRITE_MAX_ATTEMPTS раз), а ошибка пробрасывается после отправки всех пачек.
+        """
+        if not self.worksheet or not self._write_buffer:
+            return 0
+
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> int:
+        with self._buffer_lock:
+            pending, self._write_buffer = self._write_buffer, {}
+        if not pending:
+            return 0
+        # Версия до записи: если она уже не совпадает с индексом, таблицу меняли извне
+        version_before = self._get_sheet_version()
+        sheet_title = self.worksheet.title.replace("'", "''")
+        cells = list(pending.items())
+        written = 0
+        error = None
+        for start in range(0, len(cells), WRITE_CHUNK_SIZE):
+            chunk = cells[start:start + WRITE_CHUNK_SIZE]
+            body = {
+                "valueInputOption": "USER_ENTERED",
+                "data": [
+                    {"range": f"'{sheet_title}'!{gspread.utils.rowcol_to_a1(row, col)}", "values": [[value]]}
+                    for (row, col), value in chunk
+                ],
+            }
+            try:
+                _api_call("values_batch_update", self.spreadsheet.values_batch_update, body)
+            except Exception as e:
+                error = e
+                self._requeue_failed(chunk)
+                continue
+            for (row, col), value in chunk:
+                self._write_failures.pop((row, col), None)
+                self._apply_to_index(row, col, value)
+            written += len(chunk)
+
+        if written:
+            self._remember_own_version(version_before)
+            print(f"Обновлено {written} ячеек.")
+        if error is not None:
+            raise error
+        return written
+
+    def _requeue_failed(self, chunk: list[tuple[tuple[int, int], str]]):
+        """Возвращает ячейки неудавшейся пачки в буфер; после WRITE_MAX_ATTEMPTS попыток — отбрасывает."""
+        dropped = 0
+        with self._buffer_lock:
+            for key, value in chunk:
+                attempts = self._write_failures.get(key, 0) + 1
+                if attempts >= WRITE_MAX_ATTEMPTS:
+                    self._write_failures.pop(key, None)
+                    dropped += 1
+                    continue
+                self._write_failures[key] = attempts
+                # Более свежие значения, попавшие в буфер во время записи, не затираем
+                self._write_buffer.setdefault(key, value)
+        if dropped:
+            print(f"Не удалось записать {dropped} ячеек за {WRITE_MAX_ATTEMPTS} попытки, они отброшены.")
+
+    def _remember_own_version(self, version_before: str | None):
+        # Индекс уже отражает эту запись: запоминаем версию сразу после нее.
+        # Если до записи версия разошлась с индексом, проверяем таблицу при следующем поиске
+        version = self._get_sheet_version()
+        with self._lock:
+            if self._index is not None and version is not None:
+                if version_before == self._index_version:
+                    self._index_version = version
+                else:
+                    self._index_checked_at = 0.0
+
+    def batch_update_cells(self, cells: list[tuple[int, int, str]]):
+        """Записывает несколько ячеек (строка, колонка, значение) одним запросом."""
+        for row, col, value in cells:
+            self.queue_cell(row, col, value)
+        self.flush()
+
+    def update_cell(self, row: int, col: int, value: str):
+        """Обновляет значение в конкретной ячейке (вместе с уже накопленными записями)."""
+        self.queue_cell(row, col, value)
+        self.flush()
+
+
+class AsyncGoogleSheetsClient:
+    """
+    Асинхронный фасад над GoogleSheetsClient.
+    Все обращения к gspread выполняются в ограниченном пуле потоков,
+    поэтому цикл событий (вебхуки, планировщик) не блокируется на запросах к Sheets.
+    """
+
+    def __init__(
+        self,
+        client: GoogleSheetsClient,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        executor: Executor | None = None,
+    ):
+        self.sync_client = client
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gsheets")
+        self._refresh_task: asyncio.Task | None = None
+
+    @classmethod
+    async def create(cls, sheet_id: str, creds_path: str, max_workers: int = DEFAULT_MAX_WORKERS) -> "AsyncGoogleSheetsClient":
+        """Создает клиент (аутентификация и открытие таблицы — в пуле потоков)."""
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gsheets")
+        loop = asyncio.get_running_loop()
+        client = await loop.run_in_executor(executor, GoogleSheetsClient, sheet_id, creds_path)
+        return cls(client, executor=executor)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def start_token_refresh(self):
+        """Запускает фоновое обновление OAuth-токена до его истечения."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._token_refresh_loop())
+
+    async def _token_refresh_loop(self):
+        while True:
+            try:
+                delay = await self._run(self.sync_client.refresh_credentials)
+            except Exception as e:
+                print(f"Не удалось обновить токен Google: {e}")
+                delay = TOKEN_REFRESH_RETRY_DELAY
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+
+    async def build_index(self):
+        await self._run(self.sync_client.build_index)
+
+    async def find_row_by_id(self, lead_id: int) -> tuple[int | None, dict | None]:
+        return await self._run(self.sync_client.find_row_by_id, lead_id)
+
+    async def find_rows_by_ids(self, lead_ids: list[int]) -> dict[int, tuple[int, dict]]:
+        """Поиск строк для пачки сделок за один переход в пул потоков."""
+        return await self._run(self.sync_client.find_rows_by_ids, lead_ids)
+
+    async def header_index(self) -> dict[str, int]:
+        return await self._run(self.sync_client.header_index)
+
+    async def read_header(self) -> list[str]:
+        return await self._run(self.sync_client.read_header)
+
+    async def column_index(self, column_name: str) -> int | None:
+        return await self._run(self.sync_client.column_index, column_name)
+
+    def queue_cell(self, row: int, col: int, value: str):
+        """Запись в буфер — операция в памяти, выполняется сразу."""
+        self.sync_client.queue_cell(row, col, value)
+
+    def queue_row_update(self, row: int, values: dict[str, str]):
+        """Запись в буфер по именам колонок; заголовок к этому моменту уже закэширован индексом."""
+        self.sync_client.queue_row_update(row, values)
+
+    async def flush(self) -> int:
+        return await self._run(self.sync_client.flush)
+
+    async def iter_rows(self, chunk_size: int = READ_CHUNK_SIZE, width: int | None = None):
+        """
+        Асинхронно читает лист кусками по chunk_size строк и отдает пары
+        (номер строки, кортеж значений). Следующий кусок загружается, пока
+        обрабатывается текущий. width — число колонок (по заголовку из read_header());
+        без него берется закэшированный заголовок, см. header_index().
+        """
+        if not self.sync_client.worksheet:
+            return
+        if width is None:
+            width = len(await self._run(self.sync_client.get_worksheet_header))
+        if not width:
+            return
+        # Размер сетки листа из метаданных (без запроса к API)
+        row_count = getattr(self.sync_client.worksheet, "row_count", 0) or 0
+
+        def read_chunk(first_row: int) -> asyncio.Future:
+            return asyncio.ensure_future(
+                self._run(self.sync_client._read_rows, first_row, first_row + chunk_size - 1, width)
+            )
+
+        start = 2
+        next_chunk = read_chunk(start)
+        try:
+            while next_chunk is not None:
+                values = await next_chunk
+                next_chunk = None
+                # Пустые строки в конце диапазона API не возвращает, поэтому неполный кусок
+                # бывает и перед пропуском в данных: читаем дальше, пока не кончится сетка листа.
+                # Полный кусок за пределами сетки — лист вырос после получения метаданных.
+                if start + chunk_size <= row_count or len(values) == chunk_size:
+                    next_chunk = read_chunk(start + chunk_size)
+                for offset, row in enumerate(values):
+                    yield start + offset, tuple(row) + ("",) * (width - len(row))
+                start += chunk_size
+        finally:
+            if next_chunk is not None:
+                next_chunk.cancel()
+
+    def close(self):
+        """Останавливает обновление токена и пул потоков (дожидаясь текущих вызовов)."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        self._executor.shutdown(wait=True)
+
+
+# Общий на процесс клиент: аутентификация, открытие таблицы и индекс строк
+# выполняются один раз, а не при каждом вебхуке или запуске синхронизации.
+_shared_client: AsyncGoogleSheetsClient | None = None
+_shared_client_lock = asyncio.Lock()
+
+
+async def get_shared_client(
+    sheet_id: str,
+    creds_path: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> AsyncGoogleSheetsClient:
+    """Возвращает общий клиент Google Sheets; создает его при первом вызове."""
+    global _shared_client
+    async with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = await AsyncGoogleSheetsClient.create(sheet_id, creds_path, max_workers)
+    return _shared_client
+
+
+def close_shared_client():
+    """Закрывает общий клиент (при остановке приложения)."""
+    global _shared_client
+    if _shared_client is not None:
+        _shared_client.close()
+        _shared_client = None
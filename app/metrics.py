@@ -0,0 +1,159 @@
+import math
+import threading
+
+# Простой реестр метрик в текстовом формате Prometheus.
+# Метрики создаются на уровне модулей и отдаются эндпоинтом /metrics.
+# Метрика с labelnames хранит отдельное значение на каждый набор меток: metric.labels(endpoint="leads").inc()
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: list = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    """Общая часть метрик: регистрация и дочерние метрики по меткам."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, "_Metric"] = {}
+        if register:
+            _registry.append(self)
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """Метрика для конкретного набора значений меток."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with _lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _own_samples(self) -> list[tuple[str, dict, float]]:
+        raise NotImplementedError
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        """Значения метрики: (имя, метки, значение)."""
+        if not self.labelnames:
+            return self._own_samples()
+        result = []
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            for name, extra, value in child._own_samples():
+                result.append((name, {**labels, **extra}, value))
+        return result
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self.value = 0.0
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation, register=False)
+
+    def inc(self, amount: float = 1.0):
+        with _lock:
+            self.value += amount
+
+    def _own_samples(self) -> list[tuple[str, dict, float]]:
+        return [(self.name, {}, self.value)]
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент чтения."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, func=None, labelnames: tuple = (), register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self.value = 0.0
+        self._func = func
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.documentation, register=False)
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, func):
+        self._func = func
+
+    def _own_samples(self) -> list[tuple[str, dict, float]]:
+        value = self._func() if self._func else self.value
+        return [(self.name, {}, value)]
+
+
+class Histogram(_Metric):
+    """Распределение значений (например, задержек в секундах) по корзинам."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple = DEFAULT_BUCKETS,
+        labelnames: tuple = (),
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.buckets[:-1], register=False)
+
+    def observe(self, value: float):
+        with _lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def _own_samples(self) -> list[tuple[str, dict, float]]:
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else repr(bound)
+            result.append((f"{self.name}_bucket", {"le": le}, cumulative))
+        result.append((f"{self.name}_sum", {}, self.sum))
+        result.append((f"{self.name}_count", {}, self.count))
+        return result
+
+
+def render() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from app import metrics
+
+# Виды записей в outbox.
+WEBHOOK = "webhook"  # тело вебхука amoCRM как есть; разбирается вне обработки запроса
+LEAD_EVENT = "lead_event"  # событие по сделке из вебхука amoCRM -> обновить строку таблицы
+SHEET_CELLS = "sheet_cells"  # запись ячейки в таблицу (ID созданной сделки)
+
+# Состояния записи.
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+# Повторы: задержка растет вдвое с каждой попыткой, но не больше RETRY_MAX_DELAY.
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+DEFAULT_MAX_ATTEMPTS = 8
+# Сколько хранить обработанные записи: в течение этого времени повторная доставка
+# того же события отбрасывается по ключу идемпотентности.
+DONE_RETENTION_SECONDS = 24 * 3600
+
+outbox_appended = metrics.Counter(
+    "outbox_appended_total", "Записи, добавленные в outbox (без отброшенных дублей)."
+)
+outbox_duplicates = metrics.Counter(
+    "outbox_duplicates_total", "Записи, отброшенные по ключу идемпотентности."
+)
+outbox_retries = metrics.Counter(
+    "outbox_retries_total", "Неудачные попытки обработки, отложенные для повтора."
+)
+outbox_dead = metrics.Counter(
+    "outbox_dead_total", "Записи, не обработанные за максимальное число попыток."
+)
+outbox_pending = metrics.Gauge(
+    "outbox_pending", "Записи outbox, ожидающие обработки (включая отложенные повторы)."
+)
+outbox_processing = metrics.Gauge(
+    "outbox_processing", "Записи outbox, взятые в работу."
+)
+outbox_oldest_pending_age = metrics.Gauge(
+    "outbox_oldest_pending_age_seconds", "Возраст самой старой необработанной записи outbox (задержка обработки)."
+)
+
+
+class OutboxEntry:
+    """Запись outbox, выданная на обработку."""
+
+    __slots__ = ("id", "kind", "payload", "attempts", "created_at")
+
+    def __init__(self, entry_id: int, kind: str, payload: Any, attempts: int, created_at: float = 0.0):
+        self.id = entry_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = created_at  # время добавления в outbox (unix)
+
+
+class Outbox:
+    """
+    Локальная очередь исходящей работы (SQLite в режиме WAL).
+
+    События вебхуков и записи в таблицу сначала сохраняются здесь и удаляются из работы
+    только после успешной обработки. После падения процесса незавершенные записи
+    возвращаются в очередь (recover) и обрабатываются повторно.
+
+    Файл может использоваться несколькими воркерами: каждая запись берется в работу
+    одним воркером (owner), а записи с ключом раздела (partition_key, например lead_id)
+    делятся между воркерами по остатку от деления.
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS, owner: str | None = None):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.owner = owner
+        self._lock = threading.Lock()
+        # timeout: другие воркеры могут держать блокировку записи
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                idem_key TEXT UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT,
+                partition_key INTEGER,
+                claimed_by TEXT
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (kind, status, next_attempt_at);
+            -- Метрики (count по состоянию, возраст самой старой записи) не сканируют
+            -- обработанные записи, которые хранятся DONE_RETENTION_SECONDS
+            CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, created_at);
+            """
+        )
+        # Файлы, созданные до появления разделов, дополняются новыми колонками
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        for column, column_type in (("partition_key", "INTEGER"), ("claimed_by", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+
+        # Вычисляются при чтении /metrics; эндпоинт вызывает render() в потоке
+        outbox_pending.set_function(lambda: self.count(PENDING))
+        outbox_processing.set_function(lambda: self.count(PROCESSING))
+        outbox_oldest_pending_age.set_function(self.oldest_pending_age)
+
+    def append(
+        self,
+        kind: str,
+        items: Iterable[tuple[Any, str | None]],
+        claimed: bool = False,
+        partition_by: str | None = None,
+    ) -> list[int]:
+        """
+        Добавляет записи (данные, ключ идемпотентности) одной транзакцией.
+        Запись с уже известным ключом отбрасывается. С claimed=True записи сразу
+        считаются взятыми в работу: вызывающий код обрабатывает их сам и вызывает
+        complete()/fail(), а при падении процесса их повторит drainer.
+        partition_by — поле данных с целочисленным ключом раздела (например, 'lead_id').
+        Возвращает ID добавленных записей.
+        """
+        now = time.time()
+        status = PROCESSING if claimed else PENDING
+        attempts = 1 if claimed else 0
+        entry_ids = []
+        duplicates = 0
+        claimed_by = self.owner if claimed else None
+        with self._lock:
+            for payload, idem_key in items:
+                partition_key = int(payload[partition_by]) if partition_by else None
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO outbox "
+                    "(kind, idem_key, payload, status, attempts, created_at, updated_at, partition_key, claimed_by) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (kind, idem_key, json.dumps(payload, ensure_ascii=False), status, attempts, now, now,
+                     partition_key, claimed_by),
+                )
+                if cursor.rowcount:
+                    entry_ids.append(cursor.lastrowid)
+                else:
+                    duplicates += 1
+            self._conn.commit()
+        outbox_appended.inc(len(entry_ids))
+        outbox_duplicates.inc(duplicates)
+        return entry_ids
+
+    def claim(self, kind: str, limit: int, shard: tuple[int, int] | None = None) -> list[OutboxEntry]:
+        """
+        Берет в работу до limit записей вида kind, срок обработки которых наступил.
+        shard = (номер, количество): только записи без ключа раздела и с
+        partition_key % количество == номер; None — все записи.
+        """
+        shard_filter, shard_params = "", ()
+        if shard is not None:
+            shard_filter = "AND (partition_key IS NULL OR partition_key % ? = ?) "
+            shard_params = (shard[1], shard[0])
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ?, claimed_by = ? "
+                "WHERE id IN (SELECT id FROM outbox WHERE kind = ? AND status = ? AND next_attempt_at <= ? "
+                + shard_filter +
+                "ORDER BY id LIMIT ?) "
+                "RETURNING id, payload, attempts, created_at",
+                (PROCESSING, now, self.owner, kind, PENDING, now, *shard_params, limit),
+            ).fetchall()
+            self._conn.commit()
+        rows.sort()
+        return [
+            OutboxEntry(entry_id, kind, json.loads(payload), attempts, created_at)
+            for entry_id, payload, attempts, created_at in rows
+        ]
+
+    def complete(self, entry_ids: Iterable[int]):
+        """Отмечает записи обработанными."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, updated_at = ?, last_error = NULL WHERE id = ?",
+                [(DONE, now, entry_id) for entry_id in entry_ids],
+            )
+            self._conn.commit()
+
+    def fail(self, entry_ids: Iterable[int], error: str):
+        """
+        Возвращает записи в очередь с экспоненциальной задержкой.
+        После max_attempts попыток запись помечается как dead и больше не обрабатывается.
+        """
+        now = time.time()
+        params = [(entry_id,) for entry_id in entry_ids]
+        if not params:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET "
+                "status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "next_attempt_at = ? + min(?, ? * (1 << max(attempts - 1, 0))), "
+                "updated_at = ?, last_error = ? WHERE id = ?",
+                [
+                    (self.max_attempts, DEAD, PENDING, now, RETRY_MAX_DELAY, RETRY_BASE_DELAY, now, error[:1000], entry_id)
+                    for (entry_id,) in params
+                ],
+            )
+            dead = self._conn.execute(
+                f"SELECT count(*) FROM outbox WHERE status = ? AND id IN ({','.join('?' * len(params))})",
+                [DEAD] + [entry_id for (entry_id,) in params],
+            ).fetchone()[0]
+            self._conn.commit()
+        outbox_retries.inc(len(params) - dead)
+        outbox_dead.inc(dead)
+
+    def recover(self, live_owners: Iterable[str] | None = None) -> int:
+        """
+        Возвращает в очередь записи, которые были в работе у остановившегося процесса.
+        live_owners — работающие воркеры, их записи не трогаем; None — вернуть все
+        (единственный процесс после перезапуска).
+        """
+        query = "UPDATE outbox SET status = ?, next_attempt_at = 0, claimed_by = NULL WHERE status = ?"
+        params: list = [PENDING, PROCESSING]
+        if live_owners is not None:
+            live_owners = list(live_owners)
+            query += f" AND (claimed_by IS NULL OR claimed_by NOT IN ({','.join('?' * len(live_owners))}))"
+            params += live_owners
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+            self._conn.commit()
+        return cursor.rowcount
+
+    def purge(self, retention_seconds: float = DONE_RETENTION_SECONDS) -> int:
+        """Удаляет обработанные записи старше retention_seconds."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status = ? AND updated_at < ?",
+                (DONE, time.time() - retention_seconds),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def count(self, status: str) -> int:
+        """Количество записей в состоянии status."""
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM outbox WHERE status = ?", (status,)).fetchone()[0]
+
+    def oldest_pending_age(self) -> float:
+        """Сколько секунд ждет самая старая необработанная запись (0, если таких нет)."""
+        with self._lock:
+            oldest = self._conn.execute(
+                "SELECT min(created_at) FROM outbox WHERE status IN (?, ?)", (PENDING, PROCESSING)
+            ).fetchone()[0]
+        return max(0.0, time.time() - oldest) if oldest is not None else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxDrainer:
+    """
+    Фоновый разбор outbox: берет в работу пачки записей, срок обработки которых наступил,
+    и передает их обработчику своего вида.
+
+    Обработчик сам вызывает outbox.complete() для успешно обработанных записей
+    (он может делать это и позже, например после очереди воркеров). Если обработчик
+    выбросил исключение, вся пачка возвращается в очередь на повтор.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        handlers: dict[str, Callable[[list[OutboxEntry]], Awaitable[None]]],
+        batch_size: int = 500,
+        poll_interval: float = 1.0,
+        shard: Callable[[], tuple[int, int]] | None = None,
+        live_owners: Callable[[], list[str]] | None = None,
+    ):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # При нескольких воркерах: доля записей этого воркера и список живых воркеров
+        # (см. Coordinator). Без них drainer разбирает все записи.
+        self.shard = shard
+        self.live_owners = live_owners
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._purged_at = 0.0
+        self._recovered_at = 0.0
+
+    async def start(self):
+        """Возвращает в очередь незавершенные записи и запускает фоновый разбор."""
+        await self._recover()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _recover(self):
+        self._recovered_at = time.monotonic()
+        live_owners = self.live_owners() if self.live_owners else None
+        # Запросы к SQLite (с commit) выполняются в потоке, чтобы не останавливать цикл событий
+        recovered = await asyncio.to_thread(self.outbox.recover, live_owners)
+        if recovered:
+            print(f"Outbox: {recovered} незавершенных записей остановившихся воркеров возвращены в очередь.")
+
+    def wake(self):
+        """Запускает разбор, не дожидаясь следующего опроса (после добавления записей)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            for kind, handler in self.handlers.items():
+                await self._drain(kind, handler)
+
+            # Записи воркеров, которые перестали продлевать аренду, подхватываем без перезапуска
+            if self.live_owners and time.monotonic() - self._recovered_at > 60:
+                await self._recover()
+            if time.monotonic() - self._purged_at > 3600:
+                self._purged_at = time.monotonic()
+                await asyncio.to_thread(self.outbox.purge)
+
+    async def _drain(self, kind: str, handler: Callable[[list[OutboxEntry]], Awaitable[None]]):
+        while True:
+            entries = await asyncio.to_thread(
+                self.outbox.claim, kind, self.batch_size, self.shard() if self.shard else None
+            )
+            if not entries:
+                return
+            try:
+                await handler(entries)
+            except Exception as e:
+                print(f"Outbox: ошибка при обработке {len(entries)} записей '{kind}': {e}")
+                await asyncio.to_thread(self.outbox.fail, [entry.id for entry in entries], str(e))
+            if len(entries) < self.batch_size:
+                return
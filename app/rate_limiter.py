@@ -0,0 +1,57 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты запросов по алгоритму "token bucket".
+    Один экземпляр разделяется всеми корутинами, работающими с одним API.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("Частота запросов должна быть больше нуля.")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self._updated_at)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = max(self._updated_at, now)
+
+    async def acquire(self):
+        """Ждет, пока не освободится токен для очередного запроса."""
+        now = time.monotonic()
+        if self._blocked_until > now:
+            await asyncio.sleep(self._blocked_until - now)
+            now = time.monotonic()
+
+        self._refill(now)
+        # Токен резервируется сразу (баланс может уйти в минус),
+        # поэтому конкурентные вызовы выстраиваются в очередь без блокировок.
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def set_rate(self, rate: float):
+        """
+        Меняет частоту на лету (например, когда лимит API делится между несколькими
+        процессами). Емкость меняется пропорционально, накопленные токены сверх нее сгорают.
+        """
+        if rate <= 0:
+            raise ValueError("Частота запросов должна быть больше нуля.")
+        self._refill(time.monotonic())
+        self.capacity = max(self.capacity * rate / self.rate, 1.0)
+        self.rate = rate
+        self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (например, после ответа 429)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        # Пока действует пауза, токены не накапливаются.
+        self._tokens = min(self._tokens, 0.0)
+        self._updated_at = max(self._updated_at, self._blocked_until)
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import threading
+
+
+class StateStore:
+    """
+    Локальное хранилище состояния синхронизации (SQLite).
+    Хранит отпечатки строк таблицы, уже отправленных в amoCRM,
+    и отметки (watermark) инкрементальных выгрузок.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS row_fingerprints (
+                lead_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_fingerprints(self, lead_ids: list[str] | None = None) -> dict[str, str]:
+        """Возвращает сохраненные отпечатки (все или только для lead_ids): lead_id -> хэш строки."""
+        with self._lock:
+            if lead_ids is None:
+                rows = self._conn.execute("SELECT lead_id, fingerprint FROM row_fingerprints").fetchall()
+                return dict(rows)
+            result = {}
+            # Число параметров в запросе SQLite ограничено, поэтому ID передаются частями
+            for start in range(0, len(lead_ids), 500):
+                chunk = lead_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT lead_id, fingerprint FROM row_fingerprints WHERE lead_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                result.update(rows)
+        return result
+
+    def save_fingerprints(self, fingerprints: dict[str, str]):
+        """Сохраняет отпечатки строк, успешно отправленных в amoCRM."""
+        if not fingerprints:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO row_fingerprints (lead_id, fingerprint) VALUES (?, ?) "
+                "ON CONFLICT(lead_id) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                "updated_at = strftime('%s', 'now')",
+                list(fingerprints.items()),
+            )
+            self._conn.commit()
+
+    def get_watermark(self, name: str) -> int | None:
+        """Возвращает сохраненную отметку (например, updated_at последней выгрузки)."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, name: str, value: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO watermarks (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, value),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
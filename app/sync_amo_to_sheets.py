@@ -1,11 +1,20 @@
 import os
-from app.google_sheets_client import GoogleSheetsClient
+import time
+import asyncio
+from app.google_sheets_client import AsyncGoogleSheetsClient, get_shared_client
 from app.amocrm_client import AmoCRMClient
+from app.state_store import StateStore
+from app.sync_sheets_to_amo import refresh_fingerprints
+from app.outbox import Outbox, OutboxEntry, LEAD_EVENT
+from app.webhook_parser import parse_webhook_body
+from app.tracing import record_sync_run, span
 from app.config import (
     GOOGLE_SHEET_ID,
     GOOGLE_APPLICATION_CREDENTIALS,
     AMOCRM_SUBDOMAIN,
-    AMOCRM_INTEGRATION_TOKEN
+    AMOCRM_INTEGRATION_TOKEN,
+    AMOCRM_REQUESTS_PER_SECOND,
+    STATE_DB_PATH
 )
 
 # Карта для сопоставления полей amoCRM и колонок в Google Sheets.
@@ -15,80 +24,310 @@ COLUMN_MAPPING = {
     'price': 'Сумма',
 }
 
-async def _update_sheet_row(gs_client: GoogleSheetsClient, row_index: int, updates: dict):
-    """Обновляет ячейки в строке на основе словаря 'updates'."""
-    try:
-        header = gs_client.get_worksheet_header()
-        for field_name, new_value in updates.items():
-            if field_name not in COLUMN_MAPPING:
+# События по сделкам, которые переносятся в таблицу.
+LEAD_EVENT_TYPES = ('add', 'update', 'status')
+
+# Имя отметки в StateStore для инкрементальной сверки amoCRM -> Sheets.
+RECONCILE_WATERMARK = "amo_leads_updated_at"
+
+
+def _to_sheet_columns(updates: dict) -> dict[str, str]:
+    """Переводит поля amoCRM из словаря 'updates' в значения колонок таблицы."""
+    return {
+        COLUMN_MAPPING[field_name]: str(new_value)
+        for field_name, new_value in updates.items()
+        if field_name in COLUMN_MAPPING
+    }
+
+
+def _extract_updates(lead: dict, amo_client: AmoCRMClient) -> dict:
+    """Достает из данных сделки поля, которые синхронизируются с таблицей."""
+    updates = {}
+
+    # Обновление статуса (этапа): название берется из кэша справочников.
+    # Неизвестный кэшу этап не пишем, чтобы не затереть верное значение в таблице
+    if 'status_id' in lead:
+        status = amo_client.metadata.status_name(lead.get('pipeline_id'), lead['status_id'])
+        if status:
+            updates['status'] = status
+
+    # Обновление суммы
+    if 'price' in lead:
+        updates['price'] = lead.get('price', 0)
+
+    return updates
+
+
+async def _ensure_statuses(leads: list[dict], amo_client: AmoCRMClient):
+    """Обновляет кэш справочников, если этап какой-то из сделок ему неизвестен."""
+    metadata = amo_client.metadata
+    if any(
+        'status_id' in lead and not metadata.status_name(lead.get('pipeline_id'), lead['status_id'])
+        for lead in leads
+    ):
+        await metadata.refresh_on_miss()
+
+
+def _queue_lead_row(
+    amo_client: AmoCRMClient,
+    gs_client: AsyncGoogleSheetsClient,
+    lead: dict,
+    row_index: int,
+    row_data: dict | None
+) -> dict[str, str]:
+    """Ставит в буфер записи только те ячейки строки, значения которых изменились, и возвращает их."""
+    values = _to_sheet_columns(_extract_updates(lead, amo_client))
+    if row_data is not None:
+        values = {column: value for column, value in values.items() if str(row_data.get(column, '')) != value}
+    gs_client.queue_row_update(row_index, values)
+    return values
+
+
+def extract_lead_events(data: dict) -> dict[int, str | None]:
+    """
+    Достает сделки из вебхука (события добавления, изменения и смены этапа)
+    вместе с версией изменения: lead_id -> last_modified/updated_at (если есть).
+    amoCRM может присылать несколько сделок и несколько типов событий в одном запросе.
+    """
+    leads_events = data.get('leads')
+    if not isinstance(leads_events, dict):
+        return {}
+
+    lead_events = {}
+    for event_type in LEAD_EVENT_TYPES:
+        events = leads_events.get(event_type) or []
+        if isinstance(events, dict):
+            events = list(events.values())
+        for lead_info in events:
+            try:
+                lead_id = int(lead_info.get('id', 0))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if not lead_id:
+                continue
+            version = lead_info.get('last_modified') or lead_info.get('updated_at')
+            # Версия — unix-время изменения; прочие значения не используются
+            version = str(version) if str(version or '').isdigit() else None
+            known = lead_events.get(lead_id)
+            if lead_id not in lead_events or (version and (not known or int(version) > int(known))):
+                lead_events[lead_id] = version
+    return lead_events
+
+
+def extract_lead_ids(data: dict) -> list[int]:
+    """Достает ID всех сделок из вебхука."""
+    return list(extract_lead_events(data))
+
+
+def lead_event_key(lead_id: int, version: str | None) -> str | None:
+    """
+    Ключ идемпотентности события по сделке для outbox: повторная доставка того же
+    изменения (amoCRM повторяет вебхуки) не обрабатывается дважды.
+    Без версии ключа нет — событие всегда ставится в очередь.
+    """
+    return f"lead:{lead_id}:{version}" if version else None
+
+
+def lead_event_items(data: dict) -> list[tuple[dict, str | None]]:
+    """События по сделкам из вебхука в виде записей для outbox (данные, ключ идемпотентности)."""
+    return [
+        ({"lead_id": lead_id}, lead_event_key(lead_id, version))
+        for lead_id, version in extract_lead_events(data).items()
+    ]
+
+
+async def expand_webhooks(entries: list[OutboxEntry], outbox: Outbox):
+    """
+    Обработчик OutboxDrainer: разбирает сохраненные тела вебхуков и добавляет
+    в outbox события по сделкам. Нераспознанные тела не повторяются.
+    """
+    items = []
+    for entry in entries:
+        try:
+            data = parse_webhook_body(entry.payload["body"], entry.payload["content_type"])
+        except ValueError:
+            data = None
+        if not data:
+            print(f"CRITICAL: Could not parse webhook data. Raw body: {entry.payload['body']}")
+            continue
+        # Время получения вебхука: задержка события считается от него, а не от разбора
+        items.extend(
+            ({**payload, "received_at": entry.created_at}, key) for payload, key in lead_event_items(data)
+        )
+    # События делятся между воркерами по lead_id: одну сделку обрабатывает один воркер
+    await asyncio.to_thread(outbox.append, LEAD_EVENT, items, partition_by="lead_id")
+    await asyncio.to_thread(outbox.complete, [entry.id for entry in entries])
+
+
+async def process_leads(
+    lead_ids: list[int],
+    amo_client: AmoCRMClient,
+    gs_client: AsyncGoogleSheetsClient,
+    state_store: StateStore | None = None
+) -> list[int]:
+    """
+    Переносит актуальные статус и сумму пачки сделок в таблицу:
+    один запрос к amoCRM за всеми сделками и одна пакетная запись в таблицу.
+    С state_store обновляются отпечатки строк, чтобы записанная сумма
+    не вернулась в amoCRM при синхронизации Sheets -> amoCRM.
+    Возвращает сделки, данные которых не удалось получить от amoCRM (их нужно повторить).
+    """
+    with span("amo_to_sheets.process_leads", leads=len(lead_ids)) as attrs:
+        # Ищем соответствующие строки в Google Sheets (по кэшированному индексу)
+        rows_by_lead = await gs_client.find_rows_by_ids(lead_ids)
+        missing = [lead_id for lead_id in lead_ids if lead_id not in rows_by_lead]
+        attrs["not_in_sheet"] = len(missing)
+        if missing:
+            print(f"  -> Сделок нет в таблице (возможно, созданы не через интеграцию): {len(missing)}, "
+                  f"например {missing[:10]}")
+
+        if not rows_by_lead:
+            return []
+
+        await amo_client.metadata.ensure_fresh()
+        # Запрашиваем актуальные данные по сделкам, чтобы получить имена, а не ID
+        leads = await amo_client.get_leads(list(rows_by_lead))
+        await _ensure_statuses(leads, amo_client)
+
+        written = {}
+        for lead in leads:
+            row = rows_by_lead.pop(lead.get('id'), None)
+            if row is None:
                 continue
+            values = _queue_lead_row(amo_client, gs_client, lead, *row)
+            if values:
+                written[str(lead['id'])] = (row[1] or {}, values)
+        attrs["changed"] = len(written)
 
-            column_name = COLUMN_MAPPING[field_name]
-            if column_name in header:
-                col_index = header.index(column_name) + 1
-                gs_client.update_cell(row_index, col_index, str(new_value))
-    except Exception as e:
-        print(f"  -> Ошибка при обновлении строки {row_index} в таблице: {e}")
+        not_fetched = list(rows_by_lead)
+        if not_fetched:
+            attrs["not_fetched"] = len(not_fetched)
+            print(f"  -> Не удалось получить детали по сделкам от amoCRM: {not_fetched[:10]}")
 
+        try:
+            await gs_client.flush()
+        except Exception as e:
+            print(f"  -> Ошибка при обновлении таблицы: {e}")
+            raise
+        if state_store is not None:
+            refresh_fingerprints(state_store, written)
+        return not_fetched
 
-async def process_webhook(data: dict):
+
+async def process_webhook(
+    data: dict,
+    amo_client: AmoCRMClient | None = None,
+    gs_client: AsyncGoogleSheetsClient | None = None
+):
     """
-    Обрабатывает входящий вебхук от amoCRM.
-    Интересуют только события обновления сделки.
+    Обрабатывает входящий вебхук от amoCRM целиком, без очереди.
+    Клиенты передаются из приложения; при автономном запуске создаются на месте.
     """
+    if gs_client is None:
+        gs_client = await get_shared_client(
+            sheet_id=GOOGLE_SHEET_ID,
+            creds_path=GOOGLE_APPLICATION_CREDENTIALS
+        )
+    if amo_client is None:
+        async with AmoCRMClient(
+            subdomain=AMOCRM_SUBDOMAIN,
+            token=AMOCRM_INTEGRATION_TOKEN,
+            requests_per_second=AMOCRM_REQUESTS_PER_SECOND
+        ) as own_client:
+            return await process_webhook(data, own_client, gs_client)
+
     print(f"--- Получен вебхук от amoCRM: {list(data.keys())}")
 
-    # Убеждаемся, что это событие обновления сделки, которое нас интересует
-    if 'leads' not in data or ('update' not in data['leads'] and 'add' not in data['leads']):
+    lead_ids = extract_lead_ids(data)
+    if not lead_ids:
         print("  -> Событие не является обновлением/добавлением сделки, игнорируем.")
         return
 
-    event_type = 'update' if 'update' in data['leads'] else 'add'
-    lead_info = data['leads'][event_type][0]
-    lead_id = int(lead_info.get('id', 0))
+    await process_leads(lead_ids, amo_client, gs_client)
 
-    if not lead_id:
-        return
 
-    print(f"  -> Обработка обновления для сделки ID: {lead_id}")
+async def run_amo_to_sheets_reconciliation(
+    amo_client: AmoCRMClient | None = None,
+    gs_client: AsyncGoogleSheetsClient | None = None,
+    state_store: StateStore | None = None
+) -> dict | None:
+    """
+    Инкрементальная сверка amoCRM -> Google Sheets.
+    Выгружает сделки, измененные после сохраненной отметки updated_at, и переносит
+    изменения в таблицу пакетной записью после каждой страницы. Чинит пропущенные вебхуки;
+    при первом запуске (без отметки) выполняется полная сверка.
+    """
+    if state_store is None:
+        state_store = StateStore(STATE_DB_PATH)
+    if gs_client is None:
+        gs_client = await get_shared_client(
+            sheet_id=GOOGLE_SHEET_ID,
+            creds_path=GOOGLE_APPLICATION_CREDENTIALS
+        )
+    if amo_client is None:
+        async with AmoCRMClient(
+            subdomain=AMOCRM_SUBDOMAIN,
+            token=AMOCRM_INTEGRATION_TOKEN,
+            requests_per_second=AMOCRM_REQUESTS_PER_SECOND
+        ) as own_client:
+            return await run_amo_to_sheets_reconciliation(own_client, gs_client, state_store)
 
-    gs_client = GoogleSheetsClient(
-        sheet_id=GOOGLE_SHEET_ID,
-        creds_path=GOOGLE_APPLICATION_CREDENTIALS
-    )
-    amo_client = AmoCRMClient(
-        subdomain=AMOCRM_SUBDOMAIN,
-        token=AMOCRM_INTEGRATION_TOKEN
-    )
+    with span("amo_to_sheets.reconcile") as attrs:
+        summary = await _reconcile(amo_client, gs_client, state_store)
+        attrs.update(summary)
+    return summary
 
-    # Ищем соответствующую строку в Google Sheets
-    row_index, _ = gs_client.find_row_by_id(lead_id)
-    if not row_index:
-        print(f"  -> Сделка с ID {lead_id} не найдена в таблице. Возможно, она была создана не через интеграцию.")
-        return
 
-    # Запрашиваем актуальные данные по сделке, чтобы получить имена, а не ID
-    full_lead_data = await amo_client.get_lead(lead_id)
-    if not full_lead_data:
-        print(f"  -> Не удалось получить детали по сделке ID {lead_id} от amoCRM.")
-        return
+async def _reconcile(amo_client: AmoCRMClient, gs_client: AsyncGoogleSheetsClient, state_store: StateStore) -> dict:
+    await amo_client.metadata.ensure_fresh()
+    watermark = state_store.get_watermark(RECONCILE_WATERMARK) or 0
+    print(f"--- Запуск сверки amoCRM -> Google Sheets (изменения с {watermark}) ---")
+    started = time.monotonic()
 
-    # Готовим словарь с обновлениями
-    updates_to_make = {}
-    
-    # Обновление статуса (этапа)
-    status_info = full_lead_data.get('_embedded', {}).get('statuses', [])
-    if status_info:
-        updates_to_make['status'] = status_info[0].get('name', 'N/A')
+    summary = {"fetched": 0, "changed": 0, "not_in_sheet": 0}
+    async for leads in amo_client.iter_leads_updated_since(watermark):
+        rows_by_lead = await gs_client.find_rows_by_ids([lead.get('id') for lead in leads])
+        await _ensure_statuses(leads, amo_client)
+        written = {}
+        for lead in leads:
+            summary["fetched"] += 1
+            row = rows_by_lead.get(lead.get('id'))
+            if not row:
+                summary["not_in_sheet"] += 1
+                continue
+            values = _queue_lead_row(amo_client, gs_client, lead, *row)
+            if values:
+                written[str(lead['id'])] = (row[1] or {}, values)
 
-    # Обновление суммы
-    if 'price' in full_lead_data:
-        updates_to_make['price'] = full_lead_data.get('price', 0)
+        # Каждая страница записывается сразу: буфер записи общий с вебхуками,
+        # и полная сверка не должна копиться в нем целиком
+        try:
+            await gs_client.flush()
+        except Exception as e:
+            # Отметка остается на последней записанной странице: остальное будет выгружено повторно
+            print(f"  -> Ошибка при записи сверки в таблицу: {e}")
+            record_sync_run("amo_to_sheets", {
+                "changed": summary["changed"], "failed": len(written),
+                "unchanged": summary["fetched"] - summary["changed"] - len(written) - summary["not_in_sheet"],
+                "not_in_sheet": summary["not_in_sheet"]
+            }, time.monotonic() - started)
+            return summary
 
-    if not updates_to_make:
-        print("  -> В обновлении не было данных для синхронизации (статус, сумма).")
-        return
+        summary["changed"] += len(written)
+        refresh_fingerprints(state_store, written)
+        # Страницы идут по возрастанию updated_at: все сделки до этой отметки уже записаны
+        page_watermark = max(int(lead.get('updated_at') or 0) for lead in leads)
+        if page_watermark > watermark:
+            watermark = page_watermark
+            state_store.set_watermark(RECONCILE_WATERMARK, watermark)
 
-    print(f"  -> Найдены обновления для таблицы: {updates_to_make}")
-    await _update_sheet_row(gs_client, row_index, updates_to_make)
-    print(f"--- Обработка вебхука для сделки {lead_id} завершена ---")
+    unchanged = summary["fetched"] - summary["changed"] - summary["not_in_sheet"]
+    record_sync_run("amo_to_sheets", {
+        "changed": summary["changed"], "unchanged": unchanged, "not_in_sheet": summary["not_in_sheet"]
+    }, time.monotonic() - started)
+    print(
+        f"--- Сверка amoCRM -> Google Sheets завершена за {time.monotonic() - started:.1f} с: "
+        f"получено {summary['fetched']}, изменено строк {summary['changed']}, "
+        f"нет в таблице {summary['not_in_sheet']} ---"
+    )
+    return summary
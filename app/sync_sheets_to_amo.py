@@ -1,101 +1,412 @@
 import os
 import asyncio
-from app.google_sheets_client import GoogleSheetsClient
-from app.amocrm_client import AmoCRMClient
+import hashlib
+import json
+import time
+from typing import Mapping
+from app.google_sheets_client import AsyncGoogleSheetsClient, get_shared_client
+from app.amocrm_client import AmoCRMClient, MAX_BATCH_SIZE
+from app.state_store import StateStore
+from app.outbox import Outbox, OutboxEntry, SHEET_CELLS
+from app.tracing import record_sync_run, span
 from app.config import (
     GOOGLE_SHEET_ID,
     GOOGLE_APPLICATION_CREDENTIALS,
     AMOCRM_SUBDOMAIN,
-    AMOCRM_INTEGRATION_TOKEN
+    AMOCRM_INTEGRATION_TOKEN,
+    AMOCRM_REQUESTS_PER_SECOND,
+    AMOCRM_PIPELINE_NAME,
+    AMOCRM_STATUS_NAME,
+    STATE_DB_PATH,
+    SYNC_CONCURRENCY
 )
 
-# ID воронки и статуса в amoCRM, куда будут добавляться сделки.
-# ЗАМЕНИТЕ ЭТИ ЗНАЧЕНИЯ на ID из вашей amoCRM.
-PIPELINE_ID = 10215450
-STATUS_ID = 80874938
+# Колонки, которые уходят в amoCRM. По ним считается отпечаток строки:
+# если он не изменился с прошлой синхронизации, строка пропускается.
+# Поля сделки и контакты хешируются отдельно: примечание с контактами
+# добавляется, только когда изменились сами контакты.
+LEAD_COLUMNS = ('Имя', 'Сумма')
+CONTACT_COLUMNS = ('Телефон (Контакт)', 'Email (Контакт)')
+SYNCED_COLUMNS = LEAD_COLUMNS + CONTACT_COLUMNS
 
-# ID кастомных полей (если они есть).
-# ЗАМЕНИТЕ ЭТИ ЗНАЧЕНИЯ на ID полей из вашей amoCRM.
+# Сколько готовых пачек может ждать отправки, пока читаются следующие строки.
+MAX_PENDING_BATCHES = 2
+# ID новых сделок пишутся в таблицу общими пачками: запись, когда накопится столько ячеек, и в конце запуска.
+WRITE_BACK_CELLS = 5000
 
+# Новый запуск по расписанию не стартует, пока не закончился предыдущий
+_sync_lock = asyncio.Lock()
 
-def _prepare_lead_data(row: dict) -> dict:
+
+def _value(row: tuple, columns: dict[str, int], column: str, default: str = '') -> str:
+    """Значение колонки из кортежа строки (default — если такой колонки нет в таблице)."""
+    position = columns.get(column)
+    return row[position] if position is not None else default
+
+
+def _hash_columns(values: Mapping[str, str], columns: tuple[str, ...]) -> str:
+    data = [str(values.get(column, '')) for column in columns]
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _synced_values(row: tuple, columns: dict[str, int]) -> dict[str, str]:
+    """Значения синхронизируемых колонок строки."""
+    return {column: str(_value(row, columns, column)) for column in SYNCED_COLUMNS}
+
+
+def row_fingerprint(values: Mapping[str, str]) -> str:
+    """Отпечаток строки: хэш полей сделки и хэш контактов через двоеточие."""
+    return f"{_hash_columns(values, LEAD_COLUMNS)}:{_hash_columns(values, CONTACT_COLUMNS)}"
+
+
+def _changed_parts(stored: str | None, values: Mapping[str, str]) -> tuple[bool, bool]:
+    """Изменились ли поля сделки и контакты относительно сохраненного отпечатка."""
+    if stored and ":" not in stored:
+        # Отпечаток прежнего формата — один хэш по всем колонкам
+        changed = stored != _hash_columns(values, SYNCED_COLUMNS)
+        return changed, changed
+    lead_hash, _, contact_hash = (stored or "").partition(":")
+    return lead_hash != _hash_columns(values, LEAD_COLUMNS), contact_hash != _hash_columns(values, CONTACT_COLUMNS)
+
+
+def refresh_fingerprints(state_store: StateStore, written: dict[str, tuple[dict, dict]]):
+    """
+    Обновляет отпечатки строк после записи данных amoCRM в таблицу
+    (lead_id -> (значения строки до записи, записанные значения)). Иначе следующая
+    синхронизация Sheets -> amoCRM сочтет строку измененной и отправит ее обратно.
+    Отпечаток обновляется, только если до записи строка уже была синхронизирована:
+    неотправленные правки в таблице не должны потеряться.
+    """
+    written = {
+        lead_id: (row_data, values) for lead_id, (row_data, values) in written.items()
+        if any(column in values for column in SYNCED_COLUMNS)
+    }
+    if not written:
+        return
+    stored = state_store.get_fingerprints(list(written))
+    refreshed = {}
+    for lead_id, (row_data, values) in written.items():
+        before = {column: str(row_data.get(column, '')) for column in SYNCED_COLUMNS}
+        if lead_id not in stored or any(_changed_parts(stored[lead_id], before)):
+            continue
+        refreshed[lead_id] = row_fingerprint({**before, **values})
+    state_store.save_fingerprints(refreshed)
+
+
+def _prepare_lead_data(row: tuple, columns: dict[str, int]) -> dict:
     """Формирует тело запроса для создания/обновления сделки из строки таблицы."""
+    price = str(_value(row, columns, 'Сумма', '0'))
     return {
-        "name": f"Сделка по {row.get('Имя', 'N/A')}",
-        "price": int(row.get("Сумма", 0)) if str(row.get("Сумма")).isdigit() else 0,
+        "name": f"Сделка по {_value(row, columns, 'Имя', 'N/A')}",
+        "price": int(price) if price.isdigit() else 0,
     }
 
-def _prepare_note_text(row: dict, is_update: bool = False) -> str:
+def _prepare_note_text(row: tuple, columns: dict[str, int], is_update: bool = False) -> str:
     """Формирует текст примечания с контактными данными."""
     header = "Обновленные контактные данные:" if is_update else "Контактные данные из Google Sheets:"
-    phone = row.get('Телефон (Контакт)', 'не указан')
-    email = row.get('Email (Контакт)', 'не указан')
+    phone = _value(row, columns, 'Телефон (Контакт)', 'не указан')
+    email = _value(row, columns, 'Email (Контакт)', 'не указан')
     return f"{header}\nТелефон: {phone}\nEmail: {email}"
 
 
-async def run_sheets_to_amo_sync():
+class _SyncBatch:
+    """Пачка подготовленных изменений для отправки в amoCRM."""
+
+    def __init__(self):
+        self.leads_to_update = []
+        self.leads_to_create = []
+        self.update_notes = {}  # lead_id -> текст примечания (только если изменились контакты)
+        self.create_notes = {}  # request_id (номер строки) -> текст примечания
+        self.update_fingerprints = {}  # lead_id -> отпечаток строки
+        self.create_fingerprints = {}  # request_id (номер строки) -> отпечаток строки
+
+    def __len__(self):
+        return len(self.leads_to_update) + len(self.leads_to_create)
+
+
+class _IdWriteBack:
+    """
+    ID новых сделок, ожидающие записи в колонку lead_id. Параллельные отправители
+    только добавляют ячейки, а в таблицу они уходят общими пачками по WRITE_BACK_CELLS.
+    Без записанного ID строка при следующем запуске создаст сделку повторно,
+    поэтому ID сначала сохраняются в outbox: если запись не пройдет или процесс
+    упадет, их допишет OutboxDrainer.
+    """
+
+    def __init__(self, gs_client: AsyncGoogleSheetsClient, outbox: Outbox | None):
+        self.gs_client = gs_client
+        self.outbox = outbox
+        self._cells = 0
+        self._entry_ids = []
+        self._lock = asyncio.Lock()
+
+    async def add(self, cells: list[dict]):
+        if self.outbox is not None:
+            self._entry_ids += await asyncio.to_thread(
+                self.outbox.append,
+                SHEET_CELLS,
+                [(cell, f"sheet:{cell['row']}:{cell['col']}:{cell['value']}") for cell in cells],
+                claimed=True
+            )
+        for cell in cells:
+            self.gs_client.queue_cell(cell["row"], cell["col"], cell["value"])
+        self._cells += len(cells)
+        if self._cells >= WRITE_BACK_CELLS:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._cells:
+                return
+            cells, self._cells = self._cells, 0
+            entry_ids, self._entry_ids = self._entry_ids, []
+            try:
+                with span("sheets.write_lead_ids", cells=cells):
+                    await self.gs_client.flush()
+                if self.outbox is not None:
+                    await asyncio.to_thread(self.outbox.complete, entry_ids)
+            except Exception as e:
+                # Записи остаются в буфере клиента и уйдут при следующем flush()
+                print(f"  -> ОШИБКА: Не удалось записать ID сделок в таблицу: {e}")
+                if self.outbox is not None:
+                    await asyncio.to_thread(self.outbox.fail, entry_ids, str(e))
+
+
+async def _send_batch(
+    batch: _SyncBatch,
+    amo_client: AmoCRMClient,
+    state_store: StateStore,
+    lead_id_col_index: int,
+    summary: dict,
+    write_back: _IdWriteBack
+):
+    """Отправляет пачку в amoCRM, передает ID новых сделок на запись в таблицу и сохраняет отпечатки."""
+    with span(
+        "sheets_to_amo.send_batch",
+        updates=len(batch.leads_to_update),
+        creates=len(batch.leads_to_create)
+    ) as attrs:
+        notes = []
+        saved_fingerprints = {}
+        id_cells = []
+
+        if batch.leads_to_update:
+            with span("amocrm.update_leads", leads=len(batch.leads_to_update)):
+                updated_leads = await amo_client.update_leads(batch.leads_to_update)
+            for lead in updated_leads:
+                lead_id = lead.get("id")
+                fingerprint = batch.update_fingerprints.pop(str(lead_id), None)
+                if fingerprint is None:
+                    continue
+                if lead_id in batch.update_notes:
+                    notes.append((lead_id, batch.update_notes[lead_id]))
+                saved_fingerprints[str(lead_id)] = fingerprint
+                summary["updated"] += 1
+            summary["failed"] += len(batch.update_fingerprints)
+            attrs["update_failed"] = len(batch.update_fingerprints)
+
+        if batch.leads_to_create:
+            with span("amocrm.create_leads", leads=len(batch.leads_to_create)):
+                created_leads = await amo_client.create_leads(batch.leads_to_create)
+
+            for lead in created_leads:
+                request_id = lead.get("request_id")
+                if request_id not in batch.create_notes:
+                    continue
+                new_lead_id = lead["id"]
+                notes.append((new_lead_id, batch.create_notes.pop(request_id)))
+                saved_fingerprints[str(new_lead_id)] = batch.create_fingerprints[request_id]
+                summary["created"] += 1
+                id_cells.append({"row": int(request_id), "col": lead_id_col_index, "value": str(new_lead_id)})
+
+            if batch.create_notes:
+                print(f"  -> ОШИБКА: Не удалось создать сделки для строк: {list(batch.create_notes)[:10]} "
+                      f"(всего {len(batch.create_notes)}).")
+            summary["failed"] += len(batch.create_notes)
+            attrs["create_failed"] = len(batch.create_notes)
+            await write_back.add(id_cells)
+
+        if notes:
+            with span("amocrm.create_notes", notes=len(notes)):
+                await amo_client.create_notes(notes)
+
+        state_store.save_fingerprints(saved_fingerprints)
+
+
+async def _batch_sender(queue: asyncio.Queue, *args):
+    """
+    Забирает готовые пачки из очереди и отправляет их, пока читаются следующие строки.
+    Таких отправителей несколько; частоту запросов ограничивает общий лимит клиента amoCRM.
+    """
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        try:
+            await _send_batch(batch, *args)
+        except Exception as e:
+            # Пачка будет отправлена повторно при следующем запуске: отпечатки не сохранены
+            print(f"  -> ОШИБКА при отправке пачки в amoCRM: {e}")
+
+
+async def replay_sheet_cells(entries: list[OutboxEntry], gs_client: AsyncGoogleSheetsClient, outbox: Outbox):
+    """Обработчик OutboxDrainer: дописывает в таблицу ячейки, запись которых не прошла."""
+    for entry in entries:
+        gs_client.queue_cell(entry.payload["row"], entry.payload["col"], entry.payload["value"])
+    await gs_client.flush()
+    await asyncio.to_thread(outbox.complete, [entry.id for entry in entries])
+    print(f"Outbox: дописано {len(entries)} ячеек в таблицу.")
+
+
+async def run_sheets_to_amo_sync(
+    amo_client: AmoCRMClient | None = None,
+    gs_client: AsyncGoogleSheetsClient | None = None,
+    state_store: StateStore | None = None,
+    outbox: Outbox | None = None,
+    concurrency: int = SYNC_CONCURRENCY
+) -> dict | None:
     """
     Основная функция синхронизации: читает данные из Google Sheets
     и обновляет/создает сделки в amoCRM, добавляя контакты в примечания.
+    Лист читается потоком кусками; готовые пачки отправляются в concurrency
+    параллельных задач, пока читаются следующие. Отправляются только новые
+    и изменившиеся строки; возвращает сводку по запуску.
+    Если предыдущий запуск еще не закончился, новый пропускается (возвращает None).
     """
+    if state_store is None:
+        state_store = StateStore(STATE_DB_PATH)
+    if gs_client is None:
+        gs_client = await get_shared_client(
+            sheet_id=GOOGLE_SHEET_ID,
+            creds_path=GOOGLE_APPLICATION_CREDENTIALS
+        )
+    if amo_client is None:
+        # Запуск вне приложения: открываем собственный клиент на время синхронизации
+        async with AmoCRMClient(
+            subdomain=AMOCRM_SUBDOMAIN,
+            token=AMOCRM_INTEGRATION_TOKEN,
+            requests_per_second=AMOCRM_REQUESTS_PER_SECOND
+        ) as own_client:
+            return await run_sheets_to_amo_sync(own_client, gs_client, state_store, outbox, concurrency)
+
+    if _sync_lock.locked():
+        print("Синхронизация Google Sheets -> amoCRM еще выполняется, новый запуск пропущен.")
+        return None
+    async with _sync_lock:
+        return await _sync_rows(amo_client, gs_client, state_store, outbox, concurrency)
+
+
+async def _sync_rows(
+    amo_client: AmoCRMClient,
+    gs_client: AsyncGoogleSheetsClient,
+    state_store: StateStore,
+    outbox: Outbox | None,
+    concurrency: int
+) -> dict | None:
     print("--- Запуск синхронизации Google Sheets -> amoCRM ---")
-    
-    gs_client = GoogleSheetsClient(
-        sheet_id=GOOGLE_SHEET_ID,
-        creds_path=GOOGLE_APPLICATION_CREDENTIALS
-    )
-    amo_client = AmoCRMClient(
-        subdomain=AMOCRM_SUBDOMAIN,
-        token=AMOCRM_INTEGRATION_TOKEN
-    )
-    
-    records = gs_client.get_all_records()
-    if not records:
-        print("В таблице нет данных для синхронизации.")
-        return
 
-    try:
-        header = gs_client.get_worksheet().row_values(1)
-        lead_id_col_index = header.index("lead_id") + 1
-    except (ValueError, AttributeError):
+    # Заголовок читается заново при каждом запуске: колонки могли переставить после старта
+    header = await gs_client.read_header()
+    columns = {name: i for i, name in enumerate(header) if name}
+    lead_id_col_index = columns["lead_id"] + 1 if "lead_id" in columns else None
+    if not lead_id_col_index:
         print("КРИТИЧЕСКАЯ ОШИБКА: В таблице отсутствует колонка 'lead_id'.")
         return
 
-    total_rows = len(records)
-    print(f"Найдено {total_rows} строк для обработки.")
-
-    for i, row in enumerate(records):
-        row_num = i + 2
-        lead_id = row.get("lead_id")
-        
-        print(f"[{row_num-1}/{total_rows}] Обработка строки: {row}")
-
-        lead_data = _prepare_lead_data(row)
-        
-        if lead_id:
-            print(f"  -> ID {lead_id} найден. Обновление сделки и добавление примечания...")
-            await amo_client.update_lead(int(lead_id), lead_data)
-            note_text = _prepare_note_text(row, is_update=True)
-            await amo_client.create_note(int(lead_id), note_text)
-        else:
-            print("  -> ID не найден. Создание новой сделки...")
-            lead_data["pipeline_id"] = PIPELINE_ID
-            lead_data["status_id"] = STATUS_ID
-            
-            response = await amo_client.create_lead(lead_data)
-            
-            if response and "_embedded" in response and "leads" in response["_embedded"]:
-                new_lead_id = response["_embedded"]["leads"][0]["id"]
-                print(f"  -> Сделка создана, ID: {new_lead_id}. Добавление примечания...")
-                
-                note_text = _prepare_note_text(row)
-                await amo_client.create_note(new_lead_id, note_text)
-                
-                print("  -> Запись ID в таблицу...")
-                gs_client.update_cell(row_num, lead_id_col_index, str(new_lead_id))
-            else:
-                print(f"  -> ОШИБКА: Не удалось создать сделку для строки {row_num}.")
-                
-        await asyncio.sleep(0.5)
-
-    print("--- Синхронизация Google Sheets -> amoCRM завершена ---")
+    # Воронка и этап для новых сделок определяются по названиям из кэша справочников
+    await amo_client.metadata.ensure_fresh()
+    pipeline_id = amo_client.metadata.pipeline_id(AMOCRM_PIPELINE_NAME)
+    status_id = amo_client.metadata.status_id(pipeline_id, AMOCRM_STATUS_NAME)
+    if AMOCRM_PIPELINE_NAME and not pipeline_id:
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Воронка '{AMOCRM_PIPELINE_NAME}' не найдена в amoCRM.")
+        return
+    if AMOCRM_STATUS_NAME and not status_id:
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Этап '{AMOCRM_STATUS_NAME}' не найден в воронке.")
+        return
+
+    started = time.monotonic()
+    with span("sheets_to_amo.run") as attrs:
+        known_fingerprints = state_store.get_fingerprints()
+        summary = {"total": 0, "skipped": 0, "updated": 0, "created": 0, "failed": 0}
+
+        # Чтение и подготовка строк идут здесь, отправка — в concurrency параллельных задачах
+        queue = asyncio.Queue(maxsize=MAX_PENDING_BATCHES)
+        write_back = _IdWriteBack(gs_client, outbox)
+        senders = [
+            asyncio.create_task(
+                _batch_sender(queue, amo_client, state_store, lead_id_col_index, summary, write_back)
+            )
+            for _ in range(max(concurrency, 1))
+        ]
+
+        batch = _SyncBatch()
+        try:
+            async for row_num, row in gs_client.iter_rows(width=len(header)):
+                if not any(row):
+                    continue
+                summary["total"] += 1
+                lead_id = str(_value(row, columns, "lead_id")).strip()
+                if lead_id and not lead_id.isdigit():
+                    # Ошибка в одной ячейке не должна останавливать синхронизацию всего листа
+                    print(f"Строка {row_num}: некорректный lead_id '{lead_id}', строка пропущена.")
+                    summary["failed"] += 1
+                    continue
+                values = _synced_values(row, columns)
+                fingerprint = row_fingerprint(values)
+
+                if lead_id:
+                    lead_changed, contacts_changed = _changed_parts(known_fingerprints.get(lead_id), values)
+                    if not lead_changed and not contacts_changed:
+                        summary["skipped"] += 1
+                        continue
+
+                lead_data = _prepare_lead_data(row, columns)
+
+                if lead_id:
+                    lead_data["id"] = int(lead_id)
+                    batch.leads_to_update.append(lead_data)
+                    if contacts_changed:
+                        batch.update_notes[int(lead_id)] = _prepare_note_text(row, columns, is_update=True)
+                    batch.update_fingerprints[lead_id] = fingerprint
+                else:
+                    # Если справочники не загрузились, amoCRM поставит сделку в первый этап главной воронки
+                    if pipeline_id:
+                        lead_data["pipeline_id"] = pipeline_id
+                    if status_id:
+                        lead_data["status_id"] = status_id
+                    lead_data["request_id"] = str(row_num)
+                    batch.leads_to_create.append(lead_data)
+                    batch.create_notes[str(row_num)] = _prepare_note_text(row, columns)
+                    batch.create_fingerprints[str(row_num)] = fingerprint
+
+                if len(batch) >= MAX_BATCH_SIZE:
+                    await queue.put(batch)
+                    batch = _SyncBatch()
+
+            if len(batch):
+                await queue.put(batch)
+            for _ in senders:
+                await queue.put(None)
+            await asyncio.gather(*senders)
+        finally:
+            for sender in senders:
+                if not sender.done():
+                    sender.cancel()
+            # ID уже созданных сделок записываются, даже если чтение листа прервалось
+            await write_back.flush()
+        attrs.update(summary)
+
+    record_sync_run("sheets_to_amo", {
+        result: summary[result] for result in ("updated", "created", "skipped", "failed")
+    }, time.monotonic() - started)
+
+    if not summary["total"]:
+        print("В таблице нет данных для синхронизации.")
+        return summary
+
+    print(
+        f"--- Синхронизация Google Sheets -> amoCRM завершена: строк {summary['total']}, "
+        f"пропущено {summary['skipped']}, обновлено {summary['updated']}, "
+        f"создано {summary['created']}, ошибок {summary['failed']} ---"
+    )
+    return summary
@@ -0,0 +1,76 @@
+import contextvars
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+from app import metrics
+from app.config import TRACE_SPANS
+
+# Замеры времени (spans) участков синхронизации и итоги запусков.
+# Span пишет в лог одну JSON-строку и попадает в гистограмму span_duration_seconds;
+# вложенные span'ы одного запуска связаны общим trace_id и именем родителя.
+
+span_duration = metrics.Histogram(
+    "span_duration_seconds", "Длительность участков синхронизации.", labelnames=("span",)
+)
+sync_rows = metrics.Counter(
+    "sync_rows_total", "Строки (сделки), обработанные синхронизациями, по результату.", labelnames=("job", "result")
+)
+sync_run_duration = metrics.Histogram(
+    "sync_run_duration_seconds", "Длительность запусков синхронизации.",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0), labelnames=("job",)
+)
+sync_rows_per_second = metrics.Gauge(
+    "sync_rows_per_second", "Скорость последнего запуска синхронизации (строк в секунду).", labelnames=("job",)
+)
+sync_last_run = metrics.Gauge(
+    "sync_last_run_timestamp_seconds", "Время завершения последнего запуска синхронизации.", labelnames=("job",)
+)
+
+_current_span: contextvars.ContextVar[tuple[str, str] | None] = contextvars.ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Замеряет длительность блока кода. В блок передается словарь атрибутов,
+    в который можно дописать результаты (например, число строк):
+
+        with span("sheets_to_amo.send_batch", leads=len(batch)) as attrs:
+            ...
+            attrs["created"] = created
+    """
+    parent = _current_span.get()
+    trace_id = parent[0] if parent else uuid.uuid4().hex[:16]
+    token = _current_span.set((trace_id, name))
+    status = "ok"
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _current_span.reset(token)
+        span_duration.labels(span=name).observe(duration)
+        if TRACE_SPANS:
+            record = {
+                "span": name,
+                "trace_id": trace_id,
+                "parent": parent[1] if parent else None,
+                "duration_ms": round(duration * 1000, 2),
+                "status": status,
+                **attributes,
+            }
+            print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def record_sync_run(job: str, rows: dict[str, int], duration: float):
+    """Сохраняет итоги запуска синхронизации: строки по результатам, длительность и скорость."""
+    for result, count in rows.items():
+        sync_rows.labels(job=job, result=result).inc(count)
+    sync_run_duration.labels(job=job).observe(duration)
+    sync_rows_per_second.labels(job=job).set(sum(rows.values()) / duration if duration > 0 else 0.0)
+    sync_last_run.labels(job=job).set(time.time())
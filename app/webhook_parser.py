@@ -0,0 +1,90 @@
+import functools
+import json
+import re
+
+# Кэш разобранных ключей: пачка amoCRM (250 сделок) дает около 10 тысяч разных ключей
+KEY_CACHE_SIZE = 32768
+# Сегменты ключа формы amoCRM: leads[update][0][custom_fields][0][values][0][value]
+_KEY_SEGMENT = re.compile(r"\[([^\]]*)\]")
+# Подряд идущие %-последовательности: многобайтный символ UTF-8 декодируется целиком
+_PERCENT_RUN = re.compile(r"(?:%[0-9A-Fa-f]{2})+")
+
+
+def _decode_run(match: re.Match) -> str:
+    return bytes.fromhex(match[0].replace("%", "")).decode("utf-8", errors="replace")
+
+
+def _unquote(value: str) -> str:
+    """Декодирует значение формы ('+' — пробел, %XX — байты UTF-8)."""
+    if "+" in value:
+        value = value.replace("+", " ")
+    if "%" in value:
+        value = _PERCENT_RUN.sub(_decode_run, value)
+    return value
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _split_key(raw_key: str) -> tuple[str, ...]:
+    """
+    Декодирует ключ формы и разбивает его на сегменты:
+    'leads[update][0][id]' -> ('leads', 'update', '0', 'id').
+    Ключи в вебхуках amoCRM повторяются от запроса к запросу, поэтому результат кэшируется.
+    """
+    # Скобки в ключах всегда экранированы: заменяем их напрямую, без разбора %-последовательностей
+    key = _unquote(raw_key.replace("%5B", "[").replace("%5D", "]"))
+    head, bracket, rest = key.partition("[")
+    if not bracket:
+        return (key,)
+    return (head, *_KEY_SEGMENT.findall(bracket + rest))
+
+
+def _listify(node):
+    """Превращает словари с числовыми ключами ('0', '1', ...) в списки, как в JSON."""
+    if not isinstance(node, dict):
+        return node
+    items = {key: _listify(value) for key, value in node.items()}
+    if items and all(key.isdigit() for key in items):
+        return [items[key] for key in sorted(items, key=int)]
+    return items
+
+
+def parse_form(body: bytes | str) -> dict:
+    """
+    Разбирает тело вебхука amoCRM в формате x-www-form-urlencoded со скобочными ключами
+    любой вложенности в словарь той же структуры, что и JSON-вебхук.
+    Пустой сегмент ('tags[]') добавляет элемент в конец списка.
+    """
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+
+    root: dict = {}
+    for pair in body.split("&"):
+        if not pair:
+            continue
+        raw_key, _, value = pair.partition("=")
+        parts = _split_key(raw_key)
+        value = _unquote(value)
+        node = root
+        for part in parts[:-1]:
+            if part == "":
+                part = str(len(node))
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        last = parts[-1]
+        node[last if last != "" else str(len(node))] = value
+    return _listify(root)
+
+
+def parse_webhook_body(body: bytes | str, content_type: str) -> dict:
+    """
+    Разбирает тело вебхука по Content-Type (JSON или форма).
+    Некорректный JSON — ValueError; неизвестный формат — пустой словарь.
+    """
+    if "application/json" in content_type:
+        data = json.loads(body) if body else {}
+        return data if isinstance(data, dict) else {}
+    if "application/x-www-form-urlencoded" in content_type:
+        return parse_form(body)
+    return {}
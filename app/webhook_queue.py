@@ -0,0 +1,166 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from app import metrics
+from app.outbox import Outbox, OutboxEntry
+
+webhook_events_received = metrics.Counter(
+    "webhook_events_received_total", "События по сделкам, полученные из вебхуков."
+)
+webhook_events_coalesced = metrics.Counter(
+    "webhook_events_coalesced_total", "События, объединенные с уже ожидающим событием той же сделки."
+)
+webhook_leads_processed = metrics.Counter(
+    "webhook_leads_processed_total", "Сделки, обработанные воркерами очереди."
+)
+webhook_batches_failed = metrics.Counter(
+    "webhook_batches_failed_total", "Пачки сделок, обработка которых завершилась ошибкой."
+)
+webhook_queue_depth = metrics.Gauge(
+    "webhook_queue_depth", "Сделки, ожидающие обработки (в окне и в очереди воркеров)."
+)
+webhook_coalesce_ratio = metrics.Gauge(
+    "webhook_coalesce_ratio", "Доля входящих событий, схлопнутых с ожидающими."
+)
+webhook_event_latency = metrics.Histogram(
+    "webhook_event_latency_seconds", "Время от получения вебхука до записи в таблицу (включая ожидание в outbox)."
+)
+
+
+class WebhookQueue:
+    """
+    Очередь вебхуков с дебаунсом и объединением событий по lead_id.
+
+    События, пришедшие в течение окна debounce_seconds, схлопываются: по каждой сделке
+    остается одна запись, и обработчик получает актуальное состояние один раз.
+    Пачки сделок обрабатывает ограниченный пул воркеров.
+
+    События из outbox (submit_entries) подтверждаются в нем после успешной обработки
+    пачки, а при ошибке возвращаются в outbox на повтор. Обработчик может вернуть
+    список сделок, которые обработать не удалось: на повтор уходят только их события.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list[int]], Awaitable[list[int] | None]],
+        debounce_seconds: float = 2.0,
+        workers: int = 4,
+        max_batch_size: int = 50,
+        outbox: Outbox | None = None,
+    ):
+        self.handler = handler
+        self.debounce_seconds = debounce_seconds
+        self.workers = workers
+        self.max_batch_size = max_batch_size
+        self.outbox = outbox
+
+        # lead_id -> (время получения самого раннего события (unix), ID записей outbox)
+        self._pending: dict[int, tuple[float, list[int]]] = {}
+        self._in_flight: set[int] = set()
+        self._queued = 0
+        self._batches: asyncio.Queue | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+
+        webhook_queue_depth.set_function(self.depth)
+        webhook_coalesce_ratio.set_function(self._coalesce_ratio)
+
+    def depth(self) -> int:
+        """Количество сделок, ожидающих обработки."""
+        return len(self._pending) + self._queued
+
+    @staticmethod
+    def _coalesce_ratio() -> float:
+        received = webhook_events_received.value
+        return webhook_events_coalesced.value / received if received else 0.0
+
+    async def start(self):
+        """Запускает диспетчер и воркеры."""
+        self._batches = asyncio.Queue(maxsize=self.workers * 2)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatcher())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Очередь вебхуков запущена: {self.workers} воркеров, окно {self.debounce_seconds} с.")
+
+    async def stop(self):
+        """Останавливает фоновые задачи очереди."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit_entries(self, entries: list[OutboxEntry]):
+        """Обработчик OutboxDrainer: ставит в очередь события по сделкам из outbox."""
+        for entry in entries:
+            received_at = entry.payload.get("received_at", entry.created_at)
+            self._add(int(entry.payload["lead_id"]), entry.id, received_at)
+        self._notify()
+
+    def _add(self, lead_id: int, entry_id: int, received_at: float):
+        webhook_events_received.inc()
+        pending = self._pending.get(lead_id)
+        if pending is None:
+            pending = self._pending[lead_id] = (received_at, [])
+        else:
+            webhook_events_coalesced.inc()
+            if received_at < pending[0]:
+                pending = self._pending[lead_id] = (received_at, pending[1])
+        pending[1].append(entry_id)
+
+    def _notify(self):
+        if self._pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatcher(self):
+        """Ждет окно дебаунса и раскладывает накопленные сделки по пачкам."""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce_seconds)
+            self._wakeup.clear()
+
+            # Сделки, которые еще обрабатываются, остаются до следующего окна,
+            # чтобы устаревший ответ не перезаписал более свежий.
+            ready = [lead_id for lead_id in self._pending if lead_id not in self._in_flight]
+            if len(ready) < len(self._pending):
+                self._wakeup.set()
+
+            for start in range(0, len(ready), self.max_batch_size):
+                batch = {lead_id: self._pending.pop(lead_id) for lead_id in ready[start:start + self.max_batch_size]}
+                self._in_flight.update(batch)
+                self._queued += len(batch)
+                await self._batches.put(batch)
+
+    @staticmethod
+    def _entry_ids(batch: dict[int, tuple[float, list[int]]]) -> list[int]:
+        return [entry_id for _, entry_ids in batch.values() for entry_id in entry_ids]
+
+    async def _worker(self):
+        while True:
+            batch = await self._batches.get()
+            try:
+                failed = set(await self.handler(list(batch)) or ())
+                done = {lead_id: pending for lead_id, pending in batch.items() if lead_id not in failed}
+                webhook_leads_processed.inc(len(done))
+                if self.outbox is not None:
+                    await asyncio.to_thread(self.outbox.complete, self._entry_ids(done))
+                if failed:
+                    webhook_batches_failed.inc()
+                    retry = {lead_id: pending for lead_id, pending in batch.items() if lead_id in failed}
+                    print(f"Сделки не обработаны и будут повторены: {list(retry)[:10]} (всего {len(retry)}).")
+                    if self.outbox is not None:
+                        await asyncio.to_thread(
+                            self.outbox.fail, self._entry_ids(retry), "lead details were not fetched from amoCRM"
+                        )
+            except Exception as e:
+                webhook_batches_failed.inc()
+                print(f"Ошибка при обработке пачки вебхуков {list(batch)}: {e}")
+                if self.outbox is not None:
+                    await asyncio.to_thread(self.outbox.fail, self._entry_ids(batch), str(e))
+            finally:
+                now = time.time()
+                for received_at, _ in batch.values():
+                    webhook_event_latency.observe(now - received_at)
+                self._in_flight.difference_update(batch)
+                self._queued -= len(batch)
+                self._batches.task_done()
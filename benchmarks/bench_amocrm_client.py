@@ -0,0 +1,104 @@
+"""
+Бенчмарк клиента amoCRM против локального сервера-заглушки.
+
+Сравнивает задержку одного запроса:
+  - "новое соединение": новый httpx.AsyncClient на каждый запрос (прежнее поведение);
+  - "пул соединений": один долгоживущий AmoCRMClient с keep-alive.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_amocrm_client --requests 500
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from app.amocrm_client import AmoCRMClient
+
+
+async def stub_app(scope, receive, send):
+    """Минимальное ASGI-приложение, отвечающее как GET /api/v4/leads/{id}."""
+    if scope["type"] != "http":
+        return
+    body = json.dumps({"id": 1, "name": "Сделка", "price": 100}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def start_stub_server() -> tuple[uvicorn.Server, int]:
+    """Запускает сервер-заглушку в отдельном потоке и возвращает его порт."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    config = uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="error")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+
+async def bench_new_connection(base_url: str, count: int) -> list[float]:
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"{base_url}leads/{i}")
+            response.json()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def bench_pooled(base_url: str, count: int) -> list[float]:
+    latencies = []
+    # Лимит частоты отключаем, чтобы измерять только сетевые издержки
+    async with AmoCRMClient("bench", "token", requests_per_second=1_000_000, base_url=base_url) as client:
+        for i in range(count):
+            started = time.perf_counter()
+            await client.get_lead(i)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(title: str, latencies: list[float]):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[int(len(ordered) * 0.99) - 1] * 1000
+    mean = statistics.mean(latencies) * 1000
+    print(f"{title:<20} mean={mean:7.2f} мс  p50={p50:7.2f} мс  p99={p99:7.2f} мс")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    server, port = start_stub_server()
+    base_url = f"http://127.0.0.1:{port}/api/v4/"
+    try:
+        new_conn = asyncio.run(bench_new_connection(base_url, args.requests))
+        pooled = asyncio.run(bench_pooled(base_url, args.requests))
+    finally:
+        server.should_exit = True
+
+    print(f"Запросов: {args.requests}")
+    mean_new = report("новое соединение", new_conn)
+    mean_pooled = report("пул соединений", pooled)
+    print(f"Выигрыш на запрос: {mean_new - mean_pooled:.2f} мс ({mean_new / mean_pooled:.1f}x)")
+    print("Без TLS на loopback; с реальным HTTPS-рукопожатием разница больше.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Нагрузочный тест: задержка вебхуков, пока идет полная синхронизация Sheets -> amoCRM.
+
+Вебхуки отправляются в приложение из main.py (через ASGI, без сети) каждые 20 мс.
+Параллельно выполняется run_sheets_to_amo_sync на заглушках с задержкой API.
+Сравниваются два режима доступа к Sheets:
+  - "в цикле событий": вызовы gspread выполняются прямо в цикле (прежнее поведение);
+  - "пул потоков": AsyncGoogleSheetsClient выносит их в пул потоков.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_event_loop --rows 10000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, Future
+
+# main.py читает настройки при импорте
+os.environ.setdefault("AMOCRM_SUBDOMAIN", "bench")
+os.environ.setdefault("AMOCRM_INTEGRATION_TOKEN", "bench")
+os.environ.setdefault("GOOGLE_SHEET_ID", "bench")
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "bench.json")
+os.environ.setdefault("STATE_DB_PATH", os.path.join(tempfile.mkdtemp(), "state.db"))
+os.environ.setdefault("OUTBOX_DB_PATH", os.path.join(tempfile.mkdtemp(), "outbox.db"))
+os.environ.setdefault("COORDINATION_PATH", os.path.join(tempfile.mkdtemp(), "coordination.db"))
+
+import httpx
+
+import main
+from app.google_sheets_client import AsyncGoogleSheetsClient
+from app.state_store import StateStore
+from app.sync_sheets_to_amo import run_sheets_to_amo_sync
+from benchmarks.fakes import FakeAmoCRM, make_rows, make_sheets_client
+
+WEBHOOK_PAYLOAD = {"leads": {"update": [{"id": "1"}]}}
+
+
+class InlineExecutor(Executor):
+    """Выполняет функцию сразу в вызывающем потоке — имитирует блокирующий вызов в цикле."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+async def probe_webhooks(stop: asyncio.Event, interval: float) -> list[float]:
+    """
+    Шлет вебхуки в приложение по расписанию и замеряет время ответа от запланированного
+    момента отправки: если цикл событий занят, ожидание тоже попадает в задержку.
+    """
+    latencies = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        scheduled = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+            await client.post("/webhook/amocrm", json=WEBHOOK_PAYLOAD)
+            finished = time.perf_counter()
+            latencies.append(finished - scheduled)
+            # Запросы, которые не удалось отправить вовремя, считаются опоздавшими
+            scheduled += interval
+            while scheduled + interval < finished:
+                latencies.append(finished - scheduled)
+                scheduled += interval
+    return latencies
+
+
+async def run_mode(rows: int, sheets_latency: float, amo_latency: float, inline: bool) -> tuple[list[float], float]:
+    gs_client = make_sheets_client(make_rows(rows, with_ids=False), latency=sheets_latency)
+    executor = InlineExecutor() if inline else None
+    async_client = AsyncGoogleSheetsClient(gs_client, executor=executor)
+    state_store = StateStore(os.path.join(tempfile.mkdtemp(), "state.db"))
+    amo = FakeAmoCRM(latency=amo_latency)
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_webhooks(stop, interval=0.02))
+    await asyncio.sleep(0.2)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with amo.client() as amo_client:
+            await run_sheets_to_amo_sync(amo_client, async_client, state_store)
+    duration = time.perf_counter() - started
+    stop.set()
+    latencies = await probe
+    if not inline:
+        async_client.close()
+    state_store.close()
+    return latencies, duration
+
+
+def report(title: str, latencies: list[float], duration: float):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[max(int(len(ordered) * 0.99) - 1, 0)] * 1000
+    print(f"{title:<18} вебхуков={len(ordered):5d}  p50={p50:8.2f} мс  p99={p99:8.2f} мс  "
+          f"max={ordered[-1] * 1000:8.2f} мс  синхронизация={duration:6.2f} с")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="задержка одного вызова Sheets API, с")
+    parser.add_argument("--amo-latency", type=float, default=0.05, help="задержка одного запроса к amoCRM, с")
+    args = parser.parse_args()
+
+    print(f"Строк: {args.rows}, задержка Sheets {args.sheets_latency} с, amoCRM {args.amo_latency} с")
+    for title, inline in (("в цикле событий", True), ("пул потоков", False)):
+        latencies, duration = asyncio.run(run_mode(args.rows, args.sheets_latency, args.amo_latency, inline))
+        report(title, latencies, duration)
+
+
+if __name__ == "__main__":
+    main_cli()
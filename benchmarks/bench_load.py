@@ -0,0 +1,203 @@
+"""
+Нагрузочный бенчмарк без обращения к настоящим API: регрессии скорости ловятся до выкладки.
+
+amoCRM и Google Sheets заменяются заглушками из benchmarks/fakes.py с настраиваемыми
+задержкой, ограничением частоты (ответы 429) и долей ошибок. Замеряются:
+  - синхронизация Sheets -> amoCRM (run_sheets_to_amo_sync) на листах из 1k, 10k и 100k строк:
+    скорость, вызовы API на строку, p50/p99 отправки пачки (по span'ам sheets_to_amo.send_batch);
+  - всплески вебхуков через приложение из main.py (эндпоинт, outbox, очередь, запись в таблицу):
+    p50/p99 ответа эндпоинта и времени от вебхука до записи в таблицу, вызовы API на событие.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --rows 10000 --amo-rate-limit 7 --amo-error-rate 0.02 --bursts 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+# main.py и app.config читают настройки при импорте; span'ы нужны для замера пачек
+os.environ.setdefault("AMOCRM_SUBDOMAIN", "bench")
+os.environ.setdefault("AMOCRM_INTEGRATION_TOKEN", "bench")
+os.environ.setdefault("GOOGLE_SHEET_ID", "bench")
+# Файл ключа должен существовать; содержимое не читается — gspread подменяется заглушкой
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", tempfile.NamedTemporaryFile(suffix=".json", delete=False).name)
+os.environ.setdefault("STATE_DB_PATH", os.path.join(tempfile.mkdtemp(), "state.db"))
+os.environ.setdefault("OUTBOX_DB_PATH", os.path.join(tempfile.mkdtemp(), "outbox.db"))
+os.environ.setdefault("COORDINATION_PATH", os.path.join(tempfile.mkdtemp(), "coordination.db"))
+os.environ["TRACE_SPANS"] = "true"
+
+import gspread
+import httpx
+
+from app.config import AMOCRM_REQUESTS_PER_SECOND, SYNC_CONCURRENCY, WEBHOOK_DEBOUNCE_SECONDS
+from app.google_sheets_client import AsyncGoogleSheetsClient, GoogleSheetsClient
+from app.outbox import Outbox
+from app.state_store import StateStore
+from app.sync_sheets_to_amo import run_sheets_to_amo_sync
+from benchmarks.fakes import (
+    FakeAmoCRM, FakeSpreadsheet, FakeWorksheet, fake_service_account, make_rows, make_webhook_body
+)
+
+
+def percentiles(values: list[float]) -> tuple[float, float]:
+    """p50 и p99 в миллисекундах."""
+    if not values:
+        return 0.0, 0.0
+    ordered = sorted(values)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[max(int(len(ordered) * 0.99) - 1, 0)]
+    return p50 * 1000, p99 * 1000
+
+
+def span_durations(log: str, name: str) -> list[float]:
+    """Длительности span'ов name (в секундах) из JSON-строк лога."""
+    result = []
+    for line in log.splitlines():
+        if not line.startswith("{"):
+            continue
+        record = json.loads(line)
+        if record.get("span") == name:
+            result.append(record["duration_ms"] / 1000)
+    return result
+
+
+def make_fakes(args, rows: list[list[str]]) -> tuple[FakeWorksheet, FakeAmoCRM]:
+    worksheet = FakeWorksheet(
+        rows, args.sheets_latency, rate_limit=args.sheets_rate_limit, error_rate=args.sheets_error_rate
+    )
+    amo = FakeAmoCRM(args.amo_latency, rate_limit=args.amo_rate_limit, error_rate=args.amo_error_rate)
+    return worksheet, amo
+
+
+async def bench_sync(args, rows: int):
+    """Полный запуск Sheets -> amoCRM на листе из rows строк."""
+    worksheet, amo = make_fakes(args, make_rows(rows, with_ids=args.with_ids))
+    gs_client = AsyncGoogleSheetsClient(GoogleSheetsClient.from_spreadsheet(FakeSpreadsheet(worksheet)))
+    state_store = StateStore(os.path.join(tempfile.mkdtemp(), "state.db"))
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(), "outbox.db"))
+    worksheet.api_calls = 0
+
+    log = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        async with amo.client(args.amo_rps) as amo_client:
+            summary = await run_sheets_to_amo_sync(amo_client, gs_client, state_store, outbox, args.concurrency)
+    duration = time.perf_counter() - started
+
+    gs_client.close()
+    state_store.close()
+    outbox.close()
+
+    p50, p99 = percentiles(span_durations(log.getvalue(), "sheets_to_amo.send_batch"))
+    print(
+        f"строк={rows:7d}  {duration:7.2f} с  {rows / duration:8.0f} строк/с  "
+        f"amoCRM/строку={amo.api_calls / rows:.4f}  Sheets/строку={worksheet.api_calls / rows:.5f}  "
+        f"пачка p50={p50:7.1f} мс p99={p99:7.1f} мс  "
+        f"429={amo.rate_limited + worksheet.rate_limited}  ошибок API={amo.errors + worksheet.errors}  "
+        f"создано={summary['created']} обновлено={summary['updated']} не отправлено={summary['failed']}"
+    )
+
+
+async def bench_webhooks(args):
+    """Всплески вебхуков через приложение из main.py: эндпоинт -> outbox -> очередь -> таблица."""
+    worksheet, amo = make_fakes(args, make_rows(args.webhook_rows))
+    gspread.service_account = fake_service_account(FakeSpreadsheet(worksheet))
+
+    import main  # после подмены gspread: клиент Sheets создается при старте приложения
+
+    main.amo_client = amo.client(args.amo_rps)
+
+    events = args.bursts * args.webhooks * args.leads_per_webhook
+    if events > args.webhook_rows - 1:
+        raise SystemExit(f"Событий ({events}) больше, чем строк в таблице ({args.webhook_rows}).")
+
+    response_times = []
+    sent_at: dict[int, float] = {}  # строка таблицы -> время отправки вебхука
+
+    async def send(http: httpx.AsyncClient, lead_ids: list[int]):
+        started = time.perf_counter()
+        for lead_id in lead_ids:
+            # Сделка lead_id лежит в строке lead_id + 1 (первая строка — заголовок)
+            sent_at[lead_id + 1] = started
+        await http.post(
+            "/webhook/amocrm", content=make_webhook_body(lead_ids),
+            headers={"content-type": "application/x-www-form-urlencoded"}
+        )
+        response_times.append(time.perf_counter() - started)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        async with main.lifespan(main.app):
+            amo_calls, sheets_calls = amo.api_calls, worksheet.api_calls
+            worksheet.written_at.clear()
+            # Сделка 1 в заглушке amoCRM совпадает со строкой таблицы, поэтому начинаем со второй
+            next_lead = 2
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+                for burst in range(args.bursts):
+                    if burst:
+                        await asyncio.sleep(args.burst_interval)
+                    payloads = []
+                    for _ in range(args.webhooks):
+                        payloads.append(list(range(next_lead, next_lead + args.leads_per_webhook)))
+                        next_lead += args.leads_per_webhook
+                    await asyncio.gather(*(send(http, lead_ids) for lead_ids in payloads))
+
+                deadline = time.perf_counter() + args.timeout
+                while time.perf_counter() < deadline and not all(row in worksheet.written_at for row in sent_at):
+                    await asyncio.sleep(0.01)
+            amo_calls, sheets_calls = amo.api_calls - amo_calls, worksheet.api_calls - sheets_calls
+
+    delays = [worksheet.written_at[row] - sent for row, sent in sent_at.items() if row in worksheet.written_at]
+    first_sent = min(sent_at.values())
+    last_written = max((worksheet.written_at[row] for row in sent_at if row in worksheet.written_at), default=first_sent)
+    response_p50, response_p99 = percentiles(response_times)
+    delay_p50, delay_p99 = percentiles(delays)
+    print(
+        f"вебхуков={len(response_times):5d}  событий={events:6d}  записано={len(delays):6d}  "
+        f"{len(delays) / max(last_written - first_sent, 1e-9):7.0f} событий/с  "
+        f"ответ p50={response_p50:6.2f} мс p99={response_p99:6.2f} мс  "
+        f"до записи p50={delay_p50:7.1f} мс p99={delay_p99:7.1f} мс  "
+        f"amoCRM/событие={amo_calls / events:.3f}  Sheets/событие={sheets_calls / events:.3f}  "
+        f"429={amo.rate_limited + worksheet.rate_limited}  ошибок API={amo.errors + worksheet.errors}"
+    )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000], help="размеры листа для синхронизации")
+    parser.add_argument("--with-ids", action="store_true", help="строки уже связаны со сделками (обновление вместо создания)")
+    parser.add_argument("--sheets-latency", type=float, default=0.1, help="задержка одного вызова Sheets API, с")
+    parser.add_argument("--sheets-rate-limit", type=float, default=None, help="квота Sheets API, запросов в минуту")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="доля вызовов Sheets с ошибкой 503")
+    parser.add_argument("--amo-latency", type=float, default=0.05, help="задержка одного запроса к amoCRM, с")
+    parser.add_argument("--amo-rate-limit", type=float, default=None, help="лимит заглушки amoCRM, запросов в секунду")
+    parser.add_argument("--amo-error-rate", type=float, default=0.0, help="доля запросов к amoCRM с ответом 502")
+    parser.add_argument("--amo-rps", type=float, default=AMOCRM_REQUESTS_PER_SECOND, help="ограничение частоты в клиенте")
+    parser.add_argument("--concurrency", type=int, default=SYNC_CONCURRENCY, help="параллельных отправок пачек в amoCRM")
+    parser.add_argument("--webhook-rows", type=int, default=10000, help="строк в таблице для вебхуков")
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--burst-interval", type=float, default=1.0, help="пауза между всплесками, с")
+    parser.add_argument("--webhooks", type=int, default=100, help="вебхуков в одном всплеске")
+    parser.add_argument("--leads-per-webhook", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0, help="сколько ждать записи всех событий, с")
+    args = parser.parse_args()
+
+    print(f"Задержка Sheets {args.sheets_latency} с, amoCRM {args.amo_latency} с; "
+          f"лимит клиента amoCRM {args.amo_rps} запросов/с, параллельных пачек {args.concurrency}; "
+          f"окно объединения вебхуков {WEBHOOK_DEBOUNCE_SECONDS} с")
+    print("Синхронизация Sheets -> amoCRM:")
+    for rows in args.rows:
+        asyncio.run(bench_sync(args, rows))
+    print("Вебхуки amoCRM -> Sheets через main.py:")
+    asyncio.run(bench_webhooks(args))
+
+
+if __name__ == "__main__":
+    main_cli()
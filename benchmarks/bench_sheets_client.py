@@ -0,0 +1,98 @@
+"""
+Замер времени старта клиента Google Sheets и накладных расходов на один вебхук.
+
+Сравниваются два режима:
+  - "клиент на событие": на каждый вебхук создается новый клиент (аутентификация,
+    открытие таблицы, получение листа, построение индекса) — прежнее поведение;
+  - "общий клиент": один клиент на процесс создается при старте и переиспользуется.
+
+Задержки Sheets API и обмена токена имитируются заглушками из benchmarks/fakes.py.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sheets_client --events 50
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+# app.config читает настройки при импорте
+os.environ.setdefault("AMOCRM_SUBDOMAIN", "bench")
+os.environ.setdefault("AMOCRM_INTEGRATION_TOKEN", "bench")
+os.environ.setdefault("GOOGLE_SHEET_ID", "bench")
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "bench.json")
+
+import gspread
+
+from app.google_sheets_client import AsyncGoogleSheetsClient
+from app.sync_amo_to_sheets import process_leads
+from benchmarks.fakes import FakeAmoCRM, FakeSpreadsheet, FakeWorksheet, fake_service_account, make_rows
+
+
+async def measure(events: int, rows: int, sheets_latency: float, auth_latency: float, shared: bool) -> dict:
+    worksheet = FakeWorksheet(make_rows(rows), sheets_latency)
+    gspread.service_account = fake_service_account(FakeSpreadsheet(worksheet), auth_latency)
+    creds_path = tempfile.NamedTemporaryFile(suffix=".json", delete=False).name
+    amo = FakeAmoCRM()
+
+    async def create_client() -> AsyncGoogleSheetsClient:
+        client = await AsyncGoogleSheetsClient.create("bench", creds_path)
+        await client.build_index()
+        return client
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        shared_client = await create_client() if shared else None
+    startup = time.perf_counter() - started
+
+    worksheet.api_calls = 0
+    worksheet.auth_calls = 0
+    timings = []
+    async with amo.client() as amo_client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await amo_client.metadata.refresh()
+        for i in range(events):
+            lead_id = i % rows + 1
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                gs_client = shared_client or await create_client()
+                await process_leads([lead_id], amo_client, gs_client)
+                if not shared:
+                    gs_client.close()
+            timings.append(time.perf_counter() - started)
+
+    if shared_client:
+        shared_client.close()
+    os.unlink(creds_path)
+    timings.sort()
+    return {
+        "startup": startup,
+        "p50": timings[len(timings) // 2],
+        "p99": timings[max(int(len(timings) * 0.99) - 1, 0)],
+        "api_calls": worksheet.api_calls / events,
+        "auth_calls": worksheet.auth_calls / events,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--sheets-latency", type=float, default=0.15, help="задержка одного вызова Sheets API, с")
+    parser.add_argument("--auth-latency", type=float, default=0.2, help="задержка обмена токена, с")
+    args = parser.parse_args()
+
+    print(f"Вебхуков: {args.events}, строк: {args.rows}, задержка Sheets {args.sheets_latency} с, "
+          f"токена {args.auth_latency} с")
+    for title, shared in (("клиент на событие", False), ("общий клиент", True)):
+        result = asyncio.run(measure(args.events, args.rows, args.sheets_latency, args.auth_latency, shared))
+        print(f"{title:<18} старт={result['startup'] * 1000:7.1f} мс  "
+              f"вебхук p50={result['p50'] * 1000:7.1f} мс  p99={result['p99'] * 1000:7.1f} мс  "
+              f"вызовов Sheets/вебхук={result['api_calls']:.2f}  аутентификаций/вебхук={result['auth_calls']:.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
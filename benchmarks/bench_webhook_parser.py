@@ -0,0 +1,131 @@
+"""
+Микробенчмарк разбора вебхуков amoCRM в формате x-www-form-urlencoded.
+
+Сравниваются:
+  - "прежний разбор": re.match без предкомпиляции на каждый ключ, только 4-уровневые ключи;
+  - "parse_form": app.webhook_parser, ключи любой вложенности.
+Отдельно замеряется работа эндпоинта на пути запроса: сохранение тела в outbox.
+
+Тело вебхука собирается как у amoCRM: сделки с полями, тегами и кастомными полями
+(leads[update][0][custom_fields][0][values][0][value]).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_webhook_parser --leads 250
+"""
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from app.outbox import Outbox, WEBHOOK
+from app.webhook_parser import _split_key, parse_form
+
+
+def make_form_body(leads: int, custom_fields: int = 5) -> bytes:
+    """Тело вебхука amoCRM с событиями update по leads сделкам."""
+    pairs = [("account[subdomain]", "bench"), ("account[id]", "100500")]
+    for i in range(leads):
+        prefix = f"leads[update][{i}]"
+        pairs += [
+            (f"{prefix}[id]", str(1_000_000 + i)),
+            (f"{prefix}[name]", f"Сделка №{i}"),
+            (f"{prefix}[status_id]", "142"),
+            (f"{prefix}[pipeline_id]", "7"),
+            (f"{prefix}[price]", str(i * 1000)),
+            (f"{prefix}[responsible_user_id]", "1"),
+            (f"{prefix}[last_modified]", "1700000000"),
+            (f"{prefix}[modified_user_id]", "1"),
+            (f"{prefix}[created_user_id]", "1"),
+            (f"{prefix}[date_create]", "1690000000"),
+            (f"{prefix}[account_id]", "100500"),
+            (f"{prefix}[tags][0][id]", "1"),
+            (f"{prefix}[tags][0][name]", "вебхук"),
+        ]
+        for field in range(custom_fields):
+            field_prefix = f"{prefix}[custom_fields][{field}]"
+            pairs += [
+                (f"{field_prefix}[id]", str(500 + field)),
+                (f"{field_prefix}[name]", f"Поле {field}"),
+                (f"{field_prefix}[values][0][value]", f"значение {i}-{field}"),
+                (f"{field_prefix}[values][0][enum]", "0"),
+            ]
+    return urlencode(pairs).encode()
+
+
+def legacy_parse(body: bytes) -> dict:
+    """Прежний разбор из main.py (форма уже разобрана в пары ключ-значение)."""
+    reconstructed_data = {}
+    for key, value in parse_qsl(body.decode()):
+        match = re.match(r"(\w+)\[(\w+)\]\[(\d+)\]\[(\w+)\]", key)
+        if match:
+            top_key, event_type, index_str, field_name = match.groups()
+            index = int(index_str)
+            reconstructed_data.setdefault(top_key, {}).setdefault(event_type, [])
+            while len(reconstructed_data[top_key][event_type]) <= index:
+                reconstructed_data[top_key][event_type].append({})
+            reconstructed_data[top_key][event_type][index][field_name] = value
+    return reconstructed_data
+
+
+def count_values(node) -> int:
+    if isinstance(node, dict):
+        return sum(count_values(value) for value in node.values())
+    if isinstance(node, list):
+        return sum(count_values(value) for value in node)
+    return 1
+
+
+def measure(func, body: bytes, repeat: int) -> float:
+    func(body)  # прогрев (кэш ключей, импорт)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(body)
+    return (time.perf_counter() - started) / repeat
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=250, help="сделок в одном вебхуке (250 — максимум пачки amoCRM)")
+    parser.add_argument("--custom-fields", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    body = make_form_body(args.leads, args.custom_fields)
+    total_values = len(parse_qsl(body.decode()))
+    print(f"Тело вебхука: {len(body) / 1024:.1f} КБ, {total_values} ключей, сделок {args.leads}")
+
+    def parse_form_cold(raw: bytes) -> dict:
+        # Первый вебхук после запуска: ключи еще не в кэше
+        _split_key.cache_clear()
+        return parse_form(raw)
+
+    for title, func in (
+        ("прежний разбор", legacy_parse),
+        ("parse_form", parse_form),
+        ("parse_form (без кэша)", parse_form_cold),
+    ):
+        seconds = measure(func, body, args.repeat)
+        kept = count_values(func(body))
+        print(f"{title:<22} {seconds * 1000:8.2f} мс/вебхук  {total_values / seconds / 1e6:6.2f} млн ключей/с  "
+              f"сохранено значений {kept}/{total_values}")
+
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(), "outbox.db"))
+
+    def enqueue(raw: bytes):
+        # То, что эндпоинт делает на пути запроса
+        outbox.append(WEBHOOK, [(
+            {"content_type": "application/x-www-form-urlencoded", "body": raw.decode("utf-8", errors="replace")},
+            None
+        )])
+
+    seconds = measure(enqueue, body, args.repeat)
+    print(f"{'эндпоинт':<22} {seconds * 1000:8.2f} мс/вебхук  (сохранение тела в outbox, без разбора)")
+    print(f"{'sha256 тела':<22} {measure(lambda raw: hashlib.sha256(raw).hexdigest(), body, args.repeat) * 1000:8.2f} мс/вебхук")
+    outbox.close()
+
+
+if __name__ == "__main__":
+    main_cli()
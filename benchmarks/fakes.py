@@ -0,0 +1,273 @@
+"""
+Локальные заглушки amoCRM и Google Sheets для бенчмарков.
+
+Заглушка Sheets повторяет методы gspread, которые вызывает GoogleSheetsClient,
+и блокирует поток на заданную задержку — как настоящий синхронный gspread.
+Заглушка amoCRM — асинхронный транспорт httpx с эндпоинтами, которые использует AmoCRMClient.
+
+Обе заглушки умеют ограничивать частоту запросов (amoCRM отвечает 429 с Retry-After,
+Sheets — APIError 429, как при превышении квоты) и отвечать ошибками с заданной долей.
+"""
+import asyncio
+import collections
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+
+from app.amocrm_client import AmoCRMClient
+from app.google_sheets_client import GoogleSheetsClient
+
+SHEET_HEADER = ["lead_id", "Имя", "Телефон (Контакт)", "Email (Контакт)", "Сумма", "Статус"]
+
+
+def make_rows(count: int, with_ids: bool = True) -> list[list[str]]:
+    """Лист с заголовком и count строками сделок."""
+    rows = [list(SHEET_HEADER)]
+    for i in range(1, count + 1):
+        lead_id = str(i) if with_ids else ""
+        rows.append([lead_id, f"Клиент {i}", f"+7900{i:07d}", f"client{i}@example.com", str(i * 100), ""])
+    return rows
+
+
+def make_webhook_body(lead_ids: list[int], modified: int = 1700000000) -> bytes:
+    """Тело вебхука amoCRM (форма) с событиями update по сделкам lead_ids."""
+    pairs = [("account[subdomain]", "bench"), ("account[id]", "100500")]
+    for i, lead_id in enumerate(lead_ids):
+        prefix = f"leads[update][{i}]"
+        pairs += [
+            (f"{prefix}[id]", str(lead_id)),
+            (f"{prefix}[status_id]", "2"),
+            (f"{prefix}[pipeline_id]", "1"),
+            (f"{prefix}[last_modified]", str(modified)),
+        ]
+    return urlencode(pairs).encode()
+
+
+class _RateWindow:
+    """Скользящее окно: не больше limit запросов за period секунд."""
+
+    def __init__(self, limit: float, period: float):
+        self.limit = limit
+        self.period = period
+        self._times = collections.deque()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        while self._times and now - self._times[0] >= self.period:
+            self._times.popleft()
+        if len(self._times) >= self.limit:
+            return False
+        self._times.append(now)
+        return True
+
+
+def _api_error(code: int, status: str, message: str) -> APIError:
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "status": status, "message": message}}).encode()
+    return APIError(response)
+
+
+class FakeWorksheet:
+    """
+    Рабочий лист в памяти с блокирующей задержкой на каждый вызов API.
+    rate_limit — квота запросов в минуту (сверх нее APIError 429),
+    error_rate — доля вызовов, завершающихся APIError 503.
+    """
+
+    def __init__(
+        self,
+        rows: list[list[str]],
+        latency: float,
+        title: str = "Лист1",
+        rate_limit: float | None = None,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.rows = rows
+        self.latency = latency
+        self.title = title
+        self.error_rate = error_rate
+        self.api_calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.written_at: dict[int, float] = {}  # строка -> время последней записи (perf_counter)
+        self._window = _RateWindow(rate_limit, 60.0) if rate_limit else None
+        self._random = random.Random(seed)
+        # Вызовы приходят из пула потоков AsyncGoogleSheetsClient
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.api_calls += 1
+            if self._window is not None and not self._window.allow():
+                self.rate_limited += 1
+                raise _api_error(429, "RESOURCE_EXHAUSTED", "Quota exceeded for 'Read requests per minute'")
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise _api_error(503, "UNAVAILABLE", "The service is currently unavailable.")
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def get_all_values(self):
+        self._call()
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row: int):
+        self._call()
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def batch_get(self, ranges, **kwargs):
+        self._call()
+        result = []
+        for cell_range in ranges:
+            match = re.match(r"[A-Z]+(\d+):[A-Z]+(\d+)", cell_range.split("!")[-1])
+            first, last = int(match[1]), int(match[2])
+            result.append([list(row) for row in self.rows[first - 1:last]])
+        return result
+
+
+class FakeSpreadsheet:
+    """
+    Таблица в памяти: один лист и запись через values_batch_update.
+    version — время последнего изменения (Drive API); правку листа извне
+    в проверках изображают изменением rows и увеличением version.
+    """
+
+    def __init__(self, worksheet: FakeWorksheet):
+        self.sheet = worksheet
+        self.version = 0
+
+    def worksheet(self, name: str):
+        # Как и в gspread, получение листа — запрос метаданных таблицы
+        self.sheet._call()
+        return self.sheet
+
+    def get_lastUpdateTime(self):
+        return str(self.version)
+
+    def values_batch_update(self, body):
+        self.sheet._call()
+        self.version += 1
+        written_at = time.perf_counter()
+        for item in body["data"]:
+            row, col = a1_to_rowcol(item["range"].split("!")[-1])
+            self.sheet.written_at[row] = written_at
+            while len(self.sheet.rows) < row:
+                self.sheet.rows.append([])
+            cells = self.sheet.rows[row - 1]
+            cells.extend([""] * (col - len(cells)))
+            cells[col - 1] = item["values"][0][0]
+
+
+class FakeGspreadClient:
+    """Замена gspread.Client: открытие таблицы стоит одного вызова API."""
+
+    def __init__(self, spreadsheet: FakeSpreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.spreadsheet.sheet._call()
+        return self.spreadsheet
+
+
+def fake_service_account(spreadsheet: FakeSpreadsheet, auth_latency: float = 0.0):
+    """
+    Замена gspread.service_account: каждое создание клиента — обмен токена
+    с задержкой auth_latency, как при настоящей аутентификации сервисного аккаунта.
+    """
+    def service_account(filename=None, **kwargs):
+        spreadsheet.sheet.auth_calls = getattr(spreadsheet.sheet, "auth_calls", 0) + 1
+        if auth_latency:
+            time.sleep(auth_latency)
+        return FakeGspreadClient(spreadsheet)
+    return service_account
+
+
+def make_sheets_client(rows: list[list[str]], latency: float = 0.0, **faults) -> GoogleSheetsClient:
+    """GoogleSheetsClient поверх заглушки таблицы; faults — rate_limit, error_rate, seed для FakeWorksheet."""
+    return GoogleSheetsClient.from_spreadsheet(FakeSpreadsheet(FakeWorksheet(rows, latency, **faults)))
+
+
+class FakeAmoCRM:
+    """
+    Эндпоинты amoCRM v4, которые использует AmoCRMClient, с асинхронной задержкой.
+    rate_limit — запросов в секунду (сверх лимита ответ 429 с Retry-After, как у amoCRM),
+    error_rate — доля запросов с ответом 502.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: float | None = None, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.api_calls = 0
+        self.calls = collections.Counter()  # "МЕТОД путь" -> число запросов
+        self.rate_limited = 0
+        self.errors = 0
+        self.leads: dict[int, dict] = {}
+        self._next_id = 10_000_000
+        self._window = _RateWindow(rate_limit, 1.0) if rate_limit else None
+        self._random = random.Random(seed)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.api_calls += 1
+        path = request.url.path.split("/api/v4/", 1)[-1]
+        self.calls[f"{request.method} {path}"] += 1
+
+        if self._window is not None and not self._window.allow():
+            self.rate_limited += 1
+            return httpx.Response(429, headers={"Retry-After": "1"})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(502)
+
+        body = json.loads(request.content) if request.content else None
+
+        if path == "leads/pipelines":
+            statuses = [{"id": 1, "name": "Неразобранное", "type": 1, "sort": 10},
+                        {"id": 2, "name": "Первичный контакт", "type": 0, "sort": 20}]
+            return httpx.Response(200, json={"_embedded": {"pipelines": [
+                {"id": 1, "name": "Воронка", "is_main": True, "_embedded": {"statuses": statuses}}
+            ]}})
+        if path == "leads/custom_fields":
+            return httpx.Response(200, json={"_embedded": {"custom_fields": []}, "_links": {}})
+        if path == "leads/notes" and request.method == "POST":
+            return httpx.Response(200, json={"_embedded": {"notes": [{"id": i} for i, _ in enumerate(body)]}})
+        if path == "leads" and request.method == "POST":
+            created = []
+            for lead in body:
+                self._next_id += 1
+                self.leads[self._next_id] = dict(lead, id=self._next_id)
+                created.append({"id": self._next_id, "request_id": lead.get("request_id")})
+            return httpx.Response(200, json={"_embedded": {"leads": created}})
+        if path == "leads" and request.method == "PATCH":
+            for lead in body:
+                self.leads.setdefault(lead["id"], {}).update(lead)
+            return httpx.Response(200, json={"_embedded": {"leads": [{"id": lead["id"]} for lead in body]}})
+        if path == "leads" and request.method == "GET":
+            ids = [int(value) for key, value in request.url.params.multi_items() if key == "filter[id][]"]
+            leads = [{"id": i, "price": 100, "pipeline_id": 1, "status_id": 2, "updated_at": 0} for i in ids]
+            return httpx.Response(200, json={"_embedded": {"leads": leads}})
+        return httpx.Response(404)
+
+    def client(self, requests_per_second: float = 1_000_000) -> AmoCRMClient:
+        """AmoCRMClient, отправляющий запросы в заглушку (по умолчанию без ограничения частоты)."""
+        return AmoCRMClient(
+            "fake", "token", requests_per_second=requests_per_second,
+            transport=httpx.MockTransport(self.handle),
+        )
@@ -1,31 +1,176 @@
 import asyncio
-import re
+import hashlib
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # Импортируем обе наши функции синхронизации
-from app.sync_amo_to_sheets import process_webhook
-from app.sync_sheets_to_amo import run_sheets_to_amo_sync
+from app.sync_amo_to_sheets import expand_webhooks, process_leads, run_amo_to_sheets_reconciliation
+from app.sync_sheets_to_amo import replay_sheet_cells, run_sheets_to_amo_sync
+from app.amocrm_client import AmoCRMClient
+from app.google_sheets_client import AsyncGoogleSheetsClient, close_shared_client, get_shared_client
+from app.webhook_queue import WebhookQueue
+from app.state_store import StateStore
+from app.outbox import Outbox, OutboxDrainer, WEBHOOK, LEAD_EVENT, SHEET_CELLS
+from app.coordination import Coordinator, create_lease_backend
+from app import metrics
+from app.config import (
+    AMOCRM_SUBDOMAIN,
+    AMOCRM_INTEGRATION_TOKEN,
+    AMOCRM_REQUESTS_PER_SECOND,
+    AMOCRM_METADATA_TTL_MINUTES,
+    GOOGLE_SHEET_ID,
+    GOOGLE_APPLICATION_CREDENTIALS,
+    GOOGLE_SHEETS_MAX_WORKERS,
+    STATE_DB_PATH,
+    OUTBOX_DB_PATH,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_MAX_ATTEMPTS,
+    COORDINATION_BACKEND,
+    COORDINATION_PATH,
+    COORDINATION_LEASE_SECONDS,
+    RECONCILE_INTERVAL_MINUTES,
+    WEBHOOK_DEBOUNCE_SECONDS,
+    WEBHOOK_WORKERS,
+    WEBHOOK_BATCH_SIZE
+)
 
 # Загрузка переменных окружения теперь происходит в app.config
 
 scheduler = AsyncIOScheduler()
+# Один клиент amoCRM на процесс: общий пул соединений и общий лимит запросов
+amo_client = AmoCRMClient(
+    subdomain=AMOCRM_SUBDOMAIN,
+    token=AMOCRM_INTEGRATION_TOKEN,
+    requests_per_second=AMOCRM_REQUESTS_PER_SECOND,
+    metadata_ttl_seconds=AMOCRM_METADATA_TTL_MINUTES * 60
+)
+
+
+def _share_rate_limit(members: list[str]):
+    """
+    Лимит запросов amoCRM общий на аккаунт, а события делятся между всеми воркерами:
+    каждому воркеру достается равная доля AMOCRM_REQUESTS_PER_SECOND.
+    Задачи планировщика идут только в лидере и тоже получают лишь его долю (1/N),
+    даже если остальные воркеры простаивают: лимит аккаунта не превышается при
+    всплеске вебхуков во всех воркерах сразу (см. README).
+    """
+    rate = AMOCRM_REQUESTS_PER_SECOND / max(len(members), 1)
+    amo_client.rate_limiter.set_rate(rate)
+    print(f"Лимит запросов amoCRM для этого воркера: {rate:.2f} в секунду.")
+
+
+# При нескольких воркерах (uvicorn --workers N) задачи планировщика выполняет только лидер,
+# а события по сделкам делятся между воркерами по lead_id
+coordinator = Coordinator(
+    create_lease_backend(COORDINATION_BACKEND, COORDINATION_PATH),
+    lease_seconds=COORDINATION_LEASE_SECONDS,
+    on_elected=scheduler.resume,
+    on_revoked=scheduler.pause,
+    on_members_changed=_share_rate_limit
+)
+
+# Клиент Google Sheets один на процесс: создается при старте приложения,
+# хранит открытую таблицу, лист и индекс строк и обновляет токен в фоне.
+# Запросы к Sheets выполняются в пуле потоков, не блокируя цикл событий.
+gs_client: AsyncGoogleSheetsClient | None = None
+# Локальное состояние синхронизации (отпечатки строк)
+state_store = StateStore(STATE_DB_PATH)
+# События вебхуков и записи ID в таблицу хранятся здесь до успешной обработки
+outbox = Outbox(OUTBOX_DB_PATH, max_attempts=OUTBOX_MAX_ATTEMPTS, owner=coordinator.owner)
+
+
+async def _handle_lead_batch(lead_ids: list[int]):
+    """
+    Обработчик очереди вебхуков: переносит изменения пачки сделок в таблицу.
+    Возвращает сделки, данные которых amoCRM не отдал: их события повторит outbox.
+    """
+    return await process_leads(lead_ids, amo_client, gs_client, state_store)
+
+
+async def _expand_webhooks(entries):
+    await expand_webhooks(entries, outbox)
+
+
+async def _replay_sheet_cells(entries):
+    await replay_sheet_cells(entries, gs_client, outbox)
+
+
+webhook_queue = WebhookQueue(
+    handler=_handle_lead_batch,
+    debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS,
+    workers=WEBHOOK_WORKERS,
+    max_batch_size=WEBHOOK_BATCH_SIZE,
+    outbox=outbox
+)
+# Drainer разбирает тела вебхуков, передает события из outbox в очередь вебхуков
+# и повторяет неудачные записи. Порядок важен: разобранные события уходят в тот же проход.
+outbox_drainer = OutboxDrainer(
+    outbox,
+    handlers={
+        WEBHOOK: _expand_webhooks,
+        LEAD_EVENT: webhook_queue.submit_entries,
+        SHEET_CELLS: _replay_sheet_cells,
+    },
+    batch_size=OUTBOX_BATCH_SIZE,
+    shard=coordinator.shard,
+    live_owners=coordinator.members
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Контекстный менеджер для управления жизненным циклом приложения FastAPI.
-    Запускает и останавливает планировщик.
+    Открывает клиенты amoCRM и Google Sheets, запускает и останавливает планировщик.
     """
+    global gs_client
+    await amo_client.open()
+    # Воронки, этапы и кастомные поля загружаются один раз и дальше обновляются по TTL
+    await amo_client.metadata.refresh()
+    started = time.monotonic()
+    gs_client = await get_shared_client(
+        sheet_id=GOOGLE_SHEET_ID,
+        creds_path=GOOGLE_APPLICATION_CREDENTIALS,
+        max_workers=GOOGLE_SHEETS_MAX_WORKERS
+    )
+    await gs_client.build_index()
+    gs_client.start_token_refresh()
+    print(f"Клиент Google Sheets готов за {time.monotonic() - started:.2f} с.")
+    await webhook_queue.start()
+
     # Запускаем синхронизацию один раз при старте
-    # и затем каждые 5 минут
-    scheduler.add_job(run_sheets_to_amo_sync, 'interval', minutes=5, id="sheets_to_amo_job")
-    scheduler.start()
-    print("Планировщик запущен: синхронизация 'Sheets -> amoCRM' каждые 5 минут.")
+    # и затем каждые 5 минут. Пока идет предыдущий запуск, новый не стартует,
+    # а пропущенные запуски объединяются в один
+    scheduler.add_job(
+        run_sheets_to_amo_sync, 'interval', minutes=5, id="sheets_to_amo_job",
+        max_instances=1, coalesce=True,
+        kwargs={"amo_client": amo_client, "gs_client": gs_client, "state_store": state_store, "outbox": outbox}
+    )
+    # Сверка amoCRM -> Sheets чинит изменения, по которым не дошли вебхуки
+    scheduler.add_job(
+        run_amo_to_sheets_reconciliation, 'interval', minutes=RECONCILE_INTERVAL_MINUTES,
+        id="amo_to_sheets_job", max_instances=1, coalesce=True,
+        kwargs={"amo_client": amo_client, "gs_client": gs_client, "state_store": state_store}
+    )
+    # Планировщик стоит на паузе, пока этот воркер не станет лидером
+    scheduler.start(paused=True)
+    print("Планировщик запущен: синхронизация 'Sheets -> amoCRM' каждые 5 минут, "
+          f"сверка 'amoCRM -> Sheets' каждые {RECONCILE_INTERVAL_MINUTES} минут (в воркере-лидере).")
+    await coordinator.start()
+    # Незавершенные записи outbox остановившихся воркеров возвращаются в работу
+    await outbox_drainer.start()
     yield
+    await outbox_drainer.stop()
+    await coordinator.stop()
     scheduler.shutdown()
     print("Планировщик остановлен.")
+    await webhook_queue.stop()
+    await amo_client.close()
+    close_shared_client()
+    state_store.close()
+    outbox.close()
 
 app = FastAPI(
     title="AmoCRM <-> Google Sheets Sync",
@@ -39,48 +184,34 @@ async def root():
     return {"status": "ok", "message": "Service is running"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Метрики сервиса в текстовом формате Prometheus."""
+    # Часть показателей (outbox) считается запросами к SQLite: не в цикле событий
+    return await asyncio.to_thread(metrics.render)
+
+
 @app.post("/webhook/amocrm")
-async def handle_amocrm_webhook(request: Request, background_tasks: BackgroundTasks):
+async def handle_amocrm_webhook(request: Request):
     """
-    Эндпоинт для приема вебхуков от amoCRM.
-    Обрабатывает данные как в формате JSON, так и в виде данных формы.
+    Эндпоинт для приема вебхуков от amoCRM (JSON или данные формы).
+    Тело запроса сохраняется в outbox как есть, и ответ отправляется сразу:
+    разбор и обработка идут в фоне, а при ошибке или перезапуске повторяются.
     """
-    data = None
-    content_type = request.headers.get('content-type', '')
-
-    if "application/json" in content_type:
-        try:
-            data = await request.json()
-        except Exception:
-            pass  # Ошибка будет обработана ниже
-
-    elif "application/x-www-form-urlencoded" in content_type:
-        form_data = await request.form()
-        
-        reconstructed_data = {}
-        for key, value in form_data.items():
-            match = re.match(r"(\w+)\[(\w+)\]\[(\d+)\]\[(\w+)\]", key)
-            if match:
-                top_key, event_type, index_str, field_name = match.groups()
-                index = int(index_str)
-                
-                reconstructed_data.setdefault(top_key, {}).setdefault(event_type, [])
-                
-                while len(reconstructed_data[top_key][event_type]) <= index:
-                    reconstructed_data[top_key][event_type].append({})
-                
-                reconstructed_data[top_key][event_type][index][field_name] = value
-        data = reconstructed_data
-
-    if data:
-        background_tasks.add_task(process_webhook, data)
-        return {"status": "accepted"}
-    else:
-        # В случае, если данные не распознаны, логируем и возвращаем ошибку
-        body = await request.body()
-        print(f"CRITICAL: Could not parse webhook data. Raw body: {body.decode('utf-8')}")
+    body = await request.body()
+    if not body:
+        print("CRITICAL: Received empty webhook body.")
         return {"status": "error", "message": "Could not parse webhook data"}
 
+    # Повторная доставка того же вебхука отбрасывается по хэшу тела.
+    # Запись и commit в SQLite идут в потоке, чтобы не останавливать цикл событий
+    await asyncio.to_thread(outbox.append, WEBHOOK, [(
+        {"content_type": request.headers.get('content-type', ''), "body": body.decode('utf-8', errors='replace')},
+        f"webhook:{hashlib.sha256(body).hexdigest()}"
+    )])
+    outbox_drainer.wake()
+    return {"status": "accepted"}
+
 
 # Блок для ручного запуска был убран. 
 # Теперь файл предназначен для запуска через uvicorn в качестве сервера.
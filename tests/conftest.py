@@ -0,0 +1,32 @@
+"""Общие фикстуры тестов: заглушки amoCRM и Google Sheets из benchmarks/fakes.py, без настоящих API."""
+import os
+
+# app.config проверяет обязательные настройки при импорте; настоящие API в тестах не вызываются
+os.environ.setdefault("AMOCRM_SUBDOMAIN", "test")
+os.environ.setdefault("AMOCRM_INTEGRATION_TOKEN", "test")
+os.environ.setdefault("GOOGLE_SHEET_ID", "test")
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "test.json")
+
+import pytest
+
+from app.google_sheets_client import GoogleSheetsClient
+from app.state_store import StateStore
+from benchmarks.fakes import FakeSpreadsheet, FakeWorksheet, make_rows
+
+
+@pytest.fixture
+def spreadsheet():
+    """Таблица в памяти: заголовок и пять сделок с lead_id 1..5 в строках 2..6."""
+    return FakeSpreadsheet(FakeWorksheet(make_rows(5), latency=0))
+
+
+@pytest.fixture
+def sheets(spreadsheet):
+    return GoogleSheetsClient.from_spreadsheet(spreadsheet)
+
+
+@pytest.fixture
+def state_store(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
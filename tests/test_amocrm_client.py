@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+
+from app import amocrm_client
+from app.amocrm_client import AmoCRMClient
+
+
+class LeadsByUpdatedAt:
+    """GET /leads с filter[updated_at][from], сортировкой по updated_at и постраничной выдачей, как в amoCRM."""
+
+    def __init__(self, leads: dict[int, int]):
+        self.leads = leads  # id -> updated_at
+        self.requests = []
+        self.on_request = None
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        updated_from, page, limit = (
+            int(params["filter[updated_at][from]"]), int(params["page"]), int(params["limit"])
+        )
+        self.requests.append((updated_from, page))
+        if self.on_request:
+            self.on_request(len(self.requests))
+        ordered = sorted((updated_at, lead_id) for lead_id, updated_at in self.leads.items() if updated_at >= updated_from)
+        chunk = ordered[(page - 1) * limit:page * limit]
+        body = {"_embedded": {"leads": [{"id": i, "updated_at": u} for u, i in chunk]}, "_links": {}}
+        if page * limit < len(ordered):
+            body["_links"]["next"] = {"href": "next"}
+        return httpx.Response(200, json=body)
+
+
+def _fetch(handler, updated_from=0) -> list[int]:
+    async def run():
+        lead_ids = []
+        async with AmoCRMClient("test", "token", requests_per_second=1e6, transport=httpx.MockTransport(handler)) as client:
+            async for leads in client.iter_leads_updated_since(updated_from):
+                lead_ids += [lead["id"] for lead in leads]
+        return lead_ids
+    return asyncio.run(run())
+
+
+def test_keyset_paging_returns_each_lead_once(monkeypatch):
+    monkeypatch.setattr(amocrm_client, "MAX_BATCH_SIZE", 10)
+    handler = LeadsByUpdatedAt({i: 100 + i // 2 for i in range(1, 46)})
+    lead_ids = _fetch(handler)
+    assert sorted(lead_ids) == list(range(1, 46))
+    # Каждая следующая страница запрашивается от наибольшего updated_at предыдущей
+    assert all(page == 1 for _, page in handler.requests)
+    assert [updated_from for updated_from, _ in handler.requests] == sorted(u for u, _ in handler.requests)
+
+
+def test_lead_updated_mid_scan_is_not_skipped(monkeypatch):
+    monkeypatch.setattr(amocrm_client, "MAX_BATCH_SIZE", 10)
+    handler = LeadsByUpdatedAt({i: 100 + i for i in range(1, 31)})
+
+    def update_first_page_lead(request_number):
+        # С offset-страницами это сдвинуло бы выборку, и сделка 11 выпала бы между страницами
+        if request_number == 2:
+            handler.leads[3] = 1000
+
+    handler.on_request = update_first_page_lead
+    lead_ids = _fetch(handler)
+    assert set(lead_ids) == set(range(1, 31))
+    assert lead_ids.count(3) == 2  # повторно — уже с новым updated_at
+
+
+def test_full_page_with_same_updated_at(monkeypatch):
+    monkeypatch.setattr(amocrm_client, "MAX_BATCH_SIZE", 10)
+    leads = {i: 500 for i in range(1, 26)}
+    leads.update({i: 600 for i in range(26, 31)})
+    handler = LeadsByUpdatedAt(leads)
+    lead_ids = _fetch(handler)
+    assert sorted(lead_ids) == list(range(1, 31))
+    assert (500, 3) in handler.requests
+
+
+def _requests_made(handler, method: str) -> list[str]:
+    async def run():
+        async with AmoCRMClient("test", "token", requests_per_second=1e6, transport=httpx.MockTransport(handler)) as client:
+            if method == "POST":
+                return await client.create_lead({"name": "x"})
+            return await client.get_leads([1])
+    return asyncio.run(run())
+
+
+def test_post_is_not_retried_after_server_error():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(502)
+
+    assert _requests_made(handler, "POST") is None
+    assert calls == ["POST"]
+
+
+def test_get_is_retried_after_server_error(monkeypatch):
+    monkeypatch.setattr(amocrm_client, "RETRY_BASE_DELAY", 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(502)
+
+    assert _requests_made(handler, "GET") == []
+    assert calls == ["GET"] * (amocrm_client.MAX_RETRIES + 1)
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from app import google_sheets_client
+from app.google_sheets_client import AsyncGoogleSheetsClient, GoogleSheetsClient
+from benchmarks.fakes import FakeSpreadsheet, FakeWorksheet, make_rows
+
+
+def _expire_check(sheets: GoogleSheetsClient):
+    """Следующий поиск сверит версию таблицы, не дожидаясь INDEX_CHECK_INTERVAL."""
+    sheets._index_checked_at -= google_sheets_client.INDEX_CHECK_INTERVAL + 1
+
+
+def test_own_write_keeps_index(sheets, spreadsheet):
+    sheets.build_index()
+    sheets.queue_cell(3, 6, "Новый этап")
+    sheets.flush()
+    index = sheets._index
+
+    _expire_check(sheets)
+    row_num, row_data = sheets.find_row_by_id(2)
+    assert sheets._index is index
+    assert row_num == 3 and row_data["Статус"] == "Новый этап"
+
+
+def test_external_sort_rebuilds_index_despite_own_write(sheets, spreadsheet):
+    sheets.build_index()
+    rows = spreadsheet.sheet.rows
+    rows[1:] = sorted(rows[1:], key=lambda row: -int(row[0]))
+    spreadsheet.version += 1
+    # Собственная запись после сортировки не должна скрыть изменение извне
+    sheets.queue_cell(2, 6, "x")
+    sheets.flush()
+
+    _expire_check(sheets)
+    row_num, _ = sheets.find_row_by_id(2)
+    assert rows[row_num - 1][0] == "2"
+
+
+def test_header_change_moves_lead_id_column(sheets, spreadsheet):
+    sheets.build_index()
+    for number, row in enumerate(spreadsheet.sheet.rows):
+        row.insert(0, "№" if number == 0 else str(500 + number))
+
+    header = sheets.read_header()
+    assert header[:2] == ["№", "lead_id"]
+    row_num, row_data = sheets.find_row_by_id(2)
+    assert row_num == 3 and row_data["lead_id"] == "2"
+    assert sheets.find_row_by_id(502) == (None, None)
+
+
+def test_iter_rows_continues_past_blank_gap():
+    rows = make_rows(30)
+    for row in rows[6:20]:
+        row[:] = []
+    client = AsyncGoogleSheetsClient(GoogleSheetsClient.from_spreadsheet(FakeSpreadsheet(FakeWorksheet(rows, 0))))
+
+    async def read():
+        return [row_num async for row_num, row in client.iter_rows(chunk_size=5) if any(row)]
+
+    try:
+        row_nums = asyncio.run(read())
+    finally:
+        client.close()
+    assert row_nums == [2, 3, 4, 5, 6] + list(range(21, 32))
+
+
+class SizeLimitedSpreadsheet(FakeSpreadsheet):
+    """Отклоняет слишком большие запросы и записи в колонку Z, как Sheets API — запросы сверх лимита."""
+
+    max_ranges = 3
+
+    def values_batch_update(self, body):
+        if len(body["data"]) > self.max_ranges or any("Z" in item["range"] for item in body["data"]):
+            raise RuntimeError("request rejected")
+        super().values_batch_update(body)
+
+
+def test_flush_splits_large_writes(monkeypatch):
+    monkeypatch.setattr(google_sheets_client, "WRITE_CHUNK_SIZE", 3)
+    spreadsheet = SizeLimitedSpreadsheet(FakeWorksheet(make_rows(10), 0))
+    sheets = GoogleSheetsClient.from_spreadsheet(spreadsheet)
+    for row in range(2, 12):
+        sheets.queue_cell(row, 5, "1")
+    assert sheets.flush() == 10
+    assert all(row[4] == "1" for row in spreadsheet.sheet.rows[1:])
+
+
+def test_failed_chunk_does_not_block_other_writes(monkeypatch):
+    monkeypatch.setattr(google_sheets_client, "WRITE_CHUNK_SIZE", 1)
+    spreadsheet = SizeLimitedSpreadsheet(FakeWorksheet(make_rows(5), 0))
+    sheets = GoogleSheetsClient.from_spreadsheet(spreadsheet)
+    sheets.queue_cell(2, 26, "не записать")
+
+    for attempt in range(google_sheets_client.WRITE_MAX_ATTEMPTS):
+        sheets.queue_cell(3, 2, f"запись {attempt}")
+        with pytest.raises(RuntimeError):
+            sheets.flush()
+        # Соседняя запись прошла, несмотря на ошибку в другой пачке
+        assert spreadsheet.sheet.rows[2][1] == f"запись {attempt}"
+
+    # После WRITE_MAX_ATTEMPTS попыток неотправляемая ячейка отброшена
+    sheets.queue_cell(3, 2, "после")
+    assert sheets.flush() == 1
@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+
+from app.amocrm_client import AmoCRMClient
+from app.google_sheets_client import AsyncGoogleSheetsClient
+from app.outbox import Outbox
+from app.sync_amo_to_sheets import process_leads
+from app.sync_sheets_to_amo import (
+    SYNCED_COLUMNS, _changed_parts, _hash_columns, refresh_fingerprints, row_fingerprint, run_sheets_to_amo_sync
+)
+from benchmarks.fakes import FakeAmoCRM
+
+ROW = {"Имя": "Клиент 1", "Сумма": "100", "Телефон (Контакт)": "+7900", "Email (Контакт)": "a@example.com"}
+
+
+def test_changed_parts_separates_lead_and_contacts():
+    stored = row_fingerprint(ROW)
+    assert _changed_parts(stored, ROW) == (False, False)
+    assert _changed_parts(stored, {**ROW, "Сумма": "200"}) == (True, False)
+    assert _changed_parts(stored, {**ROW, "Телефон (Контакт)": "+7901"}) == (False, True)
+    assert _changed_parts(None, ROW) == (True, True)
+
+
+def test_changed_parts_reads_legacy_fingerprint():
+    legacy = _hash_columns(ROW, SYNCED_COLUMNS)
+    assert _changed_parts(legacy, ROW) == (False, False)
+    assert _changed_parts(legacy, {**ROW, "Имя": "Другой"}) == (True, True)
+
+
+def test_refresh_fingerprints_after_amo_write(state_store):
+    state_store.save_fingerprints({"1": row_fingerprint(ROW)})
+    refresh_fingerprints(state_store, {"1": (ROW, {"Сумма": "300"})})
+    assert _changed_parts(state_store.get_fingerprints(["1"])["1"], {**ROW, "Сумма": "300"}) == (False, False)
+
+
+def test_refresh_fingerprints_keeps_unsent_sheet_edits(state_store):
+    stored = row_fingerprint(ROW)
+    state_store.save_fingerprints({"1": stored})
+    # Имя изменено в таблице и еще не отправлено в amoCRM: отпечаток не трогаем
+    refresh_fingerprints(state_store, {"1": ({**ROW, "Имя": "Правка"}, {"Сумма": "300"})})
+    assert state_store.get_fingerprints(["1"])["1"] == stored
+
+
+def _run_sync(amo: FakeAmoCRM, sheets, state_store, tmp_path) -> dict:
+    gs_client = AsyncGoogleSheetsClient(sheets)
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+
+    async def run():
+        async with amo.client() as amo_client:
+            return await run_sheets_to_amo_sync(amo_client, gs_client, state_store, outbox)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        gs_client.close()
+        outbox.close()
+
+
+def test_sync_skips_rows_after_amo_write(sheets, spreadsheet, state_store, tmp_path):
+    amo = FakeAmoCRM()
+    assert _run_sync(amo, sheets, state_store, tmp_path)["updated"] == 5
+
+    # amoCRM -> Sheets записывает новую сумму; она не должна вернуться в amoCRM
+    gs_client = AsyncGoogleSheetsClient(sheets)
+
+    async def webhook():
+        async with amo.client() as amo_client:
+            return await process_leads([1, 2], amo_client, gs_client, state_store)
+
+    assert asyncio.run(webhook()) == []
+    gs_client.close()
+    summary = _run_sync(amo, sheets, state_store, tmp_path)
+    assert summary["skipped"] == 5 and summary["updated"] == 0
+
+
+def test_sync_counts_non_numeric_lead_id_as_failed(sheets, spreadsheet, state_store, tmp_path):
+    spreadsheet.sheet.rows[2][0] = "abc"
+    summary = _run_sync(FakeAmoCRM(), sheets, state_store, tmp_path)
+    assert summary["failed"] == 1 and summary["updated"] == 4
+
+
+def test_unknown_status_is_not_written(sheets, spreadsheet):
+    amo = FakeAmoCRM()
+    spreadsheet.sheet.rows[1][5] = "Первичный контакт"
+
+    async def handle(request):
+        response = await amo.handle(request)
+        if request.method == "GET" and request.url.path.endswith("/leads"):
+            data = response.json()
+            for lead in data["_embedded"]["leads"]:
+                lead["status_id"] = 999
+            return httpx.Response(200, json=data)
+        return response
+
+    gs_client = AsyncGoogleSheetsClient(sheets)
+
+    async def run():
+        async with AmoCRMClient("test", "token", requests_per_second=1e6, transport=httpx.MockTransport(handle)) as client:
+            for _ in range(3):
+                await process_leads([1], client, gs_client)
+
+    try:
+        asyncio.run(run())
+    finally:
+        gs_client.close()
+    assert spreadsheet.sheet.rows[1][5] == "Первичный контакт"
+    # Промах кэша обновляет справочники досрочно, но не чаще раза в RETRY_SECONDS
+    assert amo.calls["GET leads/pipelines"] == 2
@@ -0,0 +1,29 @@
+from app.webhook_parser import parse_form, parse_webhook_body
+from benchmarks.fakes import make_webhook_body
+
+
+def test_parse_form_builds_nested_lists():
+    data = parse_form(make_webhook_body([10, 20]))
+    assert data["account"] == {"subdomain": "bench", "id": "100500"}
+    assert [lead["id"] for lead in data["leads"]["update"]] == ["10", "20"]
+
+
+def test_parse_form_decodes_escaped_keys_and_values():
+    body = "leads%5Bstatus%5D%5B0%5D%5Bname%5D=%D0%A1%D0%B4%D0%B5%D0%BB%D0%BA%D0%B0+1"
+    assert parse_form(body) == {"leads": {"status": [{"name": "Сделка 1"}]}}
+
+
+def test_parse_form_empty_segment_appends():
+    assert parse_form("tags[]=a&tags[]=b") == {"tags": ["a", "b"]}
+
+
+def test_parse_form_deep_nesting():
+    body = "leads[update][0][custom_fields][0][values][0][value]=42"
+    field = parse_form(body)["leads"]["update"][0]["custom_fields"][0]
+    assert field == {"values": [{"value": "42"}]}
+
+
+def test_parse_webhook_body_by_content_type():
+    assert parse_webhook_body('{"leads": {}}', "application/json") == {"leads": {}}
+    assert parse_webhook_body("a=1", "application/x-www-form-urlencoded; charset=utf-8") == {"a": "1"}
+    assert parse_webhook_body("a=1", "text/plain") == {}